@@ -0,0 +1,168 @@
+import json
+import sqlite3
+import threading
+from collections import deque
+from datetime import date, datetime
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)): return value.isoformat()
+    return str(value)
+
+
+class RecentActivity:
+    """Fixed-size ring buffer of the most recent activity-log documents.
+
+    Serves the admin log view without reading the whole activity_logs
+    collection; the oldest entries fall off once maxlen is reached.
+    """
+
+    def __init__(self, maxlen=1000):
+        self._entries = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def append(self, doc):
+        with self._lock:
+            self._entries.append(doc)
+
+    def latest(self, limit=50, before=None):
+        """Up to `limit` entries, newest first, optionally only those logged before `before`."""
+        out = []
+        with self._lock:
+            for doc in reversed(self._entries):
+                if before is not None and doc['timestamp'] >= before: continue
+                out.append(doc)
+                if len(out) >= limit: break
+        return out
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SharedRecentActivity:
+    """RecentActivity for several worker processes: the newest entries live in a table of the shared SQLite database.
+
+    Every worker appends its events there, so the admin log view shows the
+    activity of all of them whichever worker serves it. Timestamps are kept
+    as fixed-width ISO strings, which sort in time order.
+    """
+
+    TABLE = '_activity'  # leading underscore: not an engine table
+
+    def __init__(self, db_path, maxlen=1000):
+        self.maxlen = maxlen
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=60.0)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS {self.TABLE} '
+                          '(seq INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT, doc TEXT)')
+        self.conn.execute(f'CREATE INDEX IF NOT EXISTS {self.TABLE}_timestamp ON {self.TABLE} (timestamp)')
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(ts):
+        return ts.isoformat(timespec='microseconds') if isinstance(ts, datetime) else str(ts)
+
+    def append(self, doc):
+        with self._lock:
+            seq = self.conn.execute(
+                f'INSERT INTO {self.TABLE} (timestamp, doc) VALUES (?, ?)',
+                (self._key(doc['timestamp']), json.dumps(doc, default=_json_default))
+            ).lastrowid
+            # Trim in steps rather than on every append
+            if seq % 100 == 0:
+                self.conn.execute(f'DELETE FROM {self.TABLE} WHERE seq <= ?', (seq - self.maxlen,))
+
+    def latest(self, limit=50, before=None):
+        """Up to `limit` entries, newest first, optionally only those logged before `before`."""
+        query = f'SELECT doc FROM {self.TABLE}'
+        params = ()
+        if before is not None:
+            query += ' WHERE timestamp < ?'
+            params = (self._key(before),)
+        with self._lock:
+            rows = self.conn.execute(query + ' ORDER BY timestamp DESC, seq DESC LIMIT ?', params + (limit,)).fetchall()
+        out = []
+        for (doc,) in rows:
+            doc = json.loads(doc)
+            doc['timestamp'] = datetime.fromisoformat(doc['timestamp'])
+            out.append(doc)
+        return out
+
+    def __len__(self):
+        with self._lock:
+            return self.conn.execute(f'SELECT COUNT(*) FROM {self.TABLE}').fetchone()[0]
+
+
+class ActivityLogSink:
+    """Buffers activity-log events and flushes them in batches by size or interval.
+
+    log() only appends to an in-memory list. A background thread flushes
+    once batch_size events are waiting or flush_interval seconds have passed:
+    the batch is first appended to a local JSON-lines file (so the log
+    survives a Firestore outage) and then handed to write_batch.
+    """
+
+    def __init__(self, write_batch, path=None, batch_size=200, flush_interval=1.0):
+        self.write_batch = write_batch
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._stop = False
+        self.logged = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self._worker = threading.Thread(target=self._run, name='activity-log-sink', daemon=True)
+        self._worker.start()
+
+    def log(self, doc):
+        with self._cond:
+            self._buffer.append(doc)
+            self.logged += 1
+            if len(self._buffer) >= self.batch_size: self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._stop or len(self._buffer) >= self.batch_size, self.flush_interval)
+                if self._stop: return
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Activity log flush failed: {e}")
+
+    def flush(self):
+        """Writes out everything buffered so far; returns the number of events flushed."""
+        with self._flush_lock:
+            with self._cond:
+                batch, self._buffer = self._buffer, []
+            if not batch: return 0
+            if self.path:
+                with open(self.path, 'a') as f:
+                    f.writelines(json.dumps(doc, default=_json_default) + '\n' for doc in batch)
+            ok = self.write_batch(batch)
+            self.flushes += 1
+            self.flushed += len(batch)
+            if ok is False: self.failed_flushes += 1
+            return len(batch)
+
+    def close(self):
+        """Stops the background thread and flushes the remaining events."""
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        self._worker.join(timeout=5)
+        self.flush()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "buffered": len(self._buffer),
+                "logged": self.logged,
+                "flushed": self.flushed,
+                "flushes": self.flushes,
+                "failed_flushes": self.failed_flushes
+            }
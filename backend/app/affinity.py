@@ -0,0 +1,142 @@
+import numpy as np
+
+from .snapshot import MAX_OVERLAY, layered_copy
+
+
+class AffinityMatrix:
+    """Dense users x categories affinity, built once and updated incrementally.
+
+    Behaviour points and survey preferences are kept as separate raw matrices so
+    that appending an interaction or replacing a survey is an O(1) cell update;
+    normalisation and the 70/30 blend happen when a row is read.
+
+    Copies share the matrices. A copy changes a row that existed when it was
+    made through a private copy of that row kept on the side; rows of users
+    added after the copy are written in place, as no earlier copy reads them.
+    """
+
+    ACTION_POINTS = {'view': 1, 'click': 2, 'purchase': 3}
+    BEHAVIOR_WEIGHT = 0.7
+    SURVEY_WEIGHT = 0.3
+
+    def __init__(self, categories):
+        self.categories = list(categories)
+        self._cat_index = {cat: i for i, cat in enumerate(self.categories)}
+        self._user_index = {}
+        self._behavior = np.zeros((0, len(self.categories)))
+        self._survey = np.zeros((0, len(self.categories)))
+        self._shared_rows = 0  # rows [0, n) of the matrices are read by other copies
+        self._overlay = {}  # row -> (behavior, survey) copies that supersede the shared rows
+        self._owned = set()  # overlay rows this copy may change in place
+
+    def build(self, interactions, products, survey_responses):
+        """Rebuilds the matrix from the full interaction and survey tables."""
+        user_ids = []
+        if not interactions.empty: user_ids.extend(interactions['user_id'].tolist())
+        if not survey_responses.empty: user_ids.extend(survey_responses['user_id'].tolist())
+        self._user_index = {uid: i for i, uid in enumerate(dict.fromkeys(user_ids))}
+        self._shared_rows, self._overlay, self._owned = 0, {}, set()
+
+        n_users, n_cats = len(self._user_index), len(self.categories)
+        self._behavior = np.zeros((max(n_users, 16), n_cats))
+        self._survey = np.zeros((max(n_users, 16), n_cats))
+
+        if not interactions.empty and not products.empty:
+            activity = interactions[['user_id', 'product_id', 'action']].merge(
+                products[['product_id', 'category']], on='product_id', how='left'
+            )
+            cat_codes = activity['category'].map(self._cat_index)
+            known = cat_codes.notna().to_numpy()
+            rows = activity['user_id'].map(self._user_index).to_numpy()[known].astype(np.intp)
+            points = activity['action'].map(self.ACTION_POINTS).fillna(0).to_numpy(dtype=float)[known]
+            np.add.at(self._behavior, (rows, cat_codes[known].to_numpy(dtype=np.intp)), points)
+
+        if not survey_responses.empty:
+            # Matches the lookup semantics of the first survey row per user
+            for uid, prefs in survey_responses.drop_duplicates('user_id')[['user_id', 'preferred_categories']].itertuples(index=False):
+                self._set_survey_row(self._user_index[uid], prefs)
+
+    def copy(self):
+        clone = AffinityMatrix(self.categories)
+        clone._user_index = layered_copy(self._user_index)
+        clone._behavior, clone._survey = self._behavior, self._survey
+        clone._shared_rows = len(self._user_index)
+        if len(self._overlay) > MAX_OVERLAY:
+            clone._behavior, clone._survey = self._merged()
+        else:
+            clone._overlay = dict(self._overlay)
+        return clone
+
+    def _merged(self):
+        """Private copies of the matrices with the overlay rows written back."""
+        behavior, survey = self._behavior.copy(), self._survey.copy()
+        for row, (b, s) in self._overlay.items():
+            behavior[row], survey[row] = b, s
+        return behavior, survey
+
+    def _writable(self, row):
+        """The behaviour and survey vectors of a row that this copy may change in place."""
+        if row >= self._shared_rows: return self._behavior[row], self._survey[row]
+        if row not in self._owned:
+            b, s = self._overlay.get(row, (self._behavior[row], self._survey[row]))
+            self._overlay[row] = (b.copy(), s.copy())
+            self._owned.add(row)
+        return self._overlay[row]
+
+    def _ensure_row(self, user_id):
+        row = self._user_index.get(user_id)
+        if row is not None: return row
+        row = len(self._user_index)
+        if row >= len(self._behavior):
+            grow = max(16, len(self._behavior))
+            behavior, survey = self._merged()
+            # Fresh matrices are private to this copy
+            self._behavior = np.vstack([behavior, np.zeros((grow, len(self.categories)))])
+            self._survey = np.vstack([survey, np.zeros((grow, len(self.categories)))])
+            self._shared_rows, self._overlay, self._owned = 0, {}, set()
+        else:
+            # May hold what a discarded copy wrote
+            self._behavior[row], self._survey[row] = 0.0, 0.0
+        self._user_index[user_id] = row
+        return row
+
+    def _set_survey_row(self, row, preferred_categories):
+        survey = self._writable(row)[1]
+        survey[:] = 0.0
+        if isinstance(preferred_categories, str):
+            preferred_categories = preferred_categories.split('|')
+        if not isinstance(preferred_categories, (list, tuple, set)): return
+        for cat in preferred_categories:
+            if cat in self._cat_index: survey[self._cat_index[cat]] = 1.0
+
+    def add_interaction(self, user_id, category, action):
+        """Adds the points of one interaction to the user's behaviour row."""
+        cat = self._cat_index.get(category)
+        if cat is None: return
+        self._writable(self._ensure_row(user_id))[0][cat] += self.ACTION_POINTS.get(action, 0)
+
+    def set_survey(self, user_id, preferred_categories):
+        """Replaces the user's survey preferences (list or '|'-joined string)."""
+        self._set_survey_row(self._ensure_row(user_id), preferred_categories)
+
+    def rows(self, user_ids):
+        """Blended affinity rows for the given users; unknown users get zeros."""
+        out = np.zeros((len(user_ids), len(self.categories)))
+        present = [(i, self._user_index[uid]) for i, uid in enumerate(user_ids) if uid in self._user_index]
+        if not present: return out
+        dest, src = (np.array(idx, dtype=np.intp) for idx in zip(*present))
+
+        behavior, survey = self._behavior[src], self._survey[src]
+        if self._overlay:
+            for i, row in enumerate(src.tolist()):
+                if row in self._overlay: behavior[i], survey[i] = self._overlay[row]
+        b_tot = behavior.sum(axis=1, keepdims=True)
+        s_tot = survey.sum(axis=1, keepdims=True)
+        behavior = np.divide(behavior, b_tot, out=np.zeros_like(behavior), where=b_tot > 0)
+        survey = np.divide(survey, s_tot, out=np.zeros_like(survey), where=s_tot > 0)
+        out[dest] = self.BEHAVIOR_WEIGHT * behavior + self.SURVEY_WEIGHT * survey
+        return out
+
+    def get(self, user_id):
+        """Affinity of one user as {category: score}."""
+        return dict(zip(self.categories, self.rows([user_id])[0].tolist()))
@@ -0,0 +1,288 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+
+class CartService:
+    """Active carts held in memory, read through from and debounced back to Firestore.
+
+    Reads are served from memory; a cart missing locally is loaded once from
+    the "carts" collection. Edits mark the cart dirty and push its persist
+    deadline debounce_seconds into the future, so a burst of edits becomes a
+    single remote write. Carts idle for ttl_seconds are written back if dirty
+    and evicted. Without Firestore the carts simply live in memory.
+    """
+
+    def __init__(self, fs=None, ttl_seconds=1800, debounce_seconds=2.0):
+        self.fs = fs
+        self.ttl_seconds = ttl_seconds
+        self.debounce_seconds = debounce_seconds
+        self._carts = OrderedDict()  # (user_id, store_id) -> cart state, least recently used first
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self.remote_reads = 0
+        self.remote_writes = 0
+        self._flusher = threading.Thread(target=self._run, name='cart-flusher', daemon=True)
+        self._flusher.start()
+
+    @staticmethod
+    def cart_id(user_id, store_id):
+        return f"CART_{user_id}_{store_id}"
+
+    def _remote(self):
+        return self.fs is not None and self.fs.db is not None
+
+    def _fetch(self, user_id, store_id):
+        """(items, updated_at) of the stored cart from Firestore, or an empty cart."""
+        if not self._remote(): return {}, None
+        self.remote_reads += 1
+        doc = self.fs.get_document("carts", self.cart_id(user_id, store_id))
+        if not doc: return {}, None
+        return {i["productId"]: int(i["quantity"]) for i in doc.get("items", [])}, doc.get("updatedAt")
+
+    def _with_cart(self, user_id, store_id, fn):
+        """Runs fn(cart) under the lock; a cart missing from memory is fetched first, outside the lock."""
+        key = (user_id, store_id)
+        while True:
+            with self._lock:
+                cart = self._carts.get(key)
+                if cart is not None:
+                    cart["touched"] = time.monotonic()
+                    self._carts.move_to_end(key)
+                    return fn(cart)
+            # A slow Firestore read must not stall the other users' carts
+            items, updated_at = self._fetch(user_id, store_id)
+            with self._lock:
+                # Another request may have loaded (and edited) the cart meanwhile; that copy wins
+                self._carts.setdefault(key, {"items": items, "updated_at": updated_at, "dirty": False,
+                                             "due": None, "touched": time.monotonic()})
+
+    def _doc(self, user_id, store_id, cart):
+        return {
+            "userId": user_id,
+            "storeId": store_id,
+            "items": [{"productId": pid, "quantity": qty} for pid, qty in cart["items"].items()],
+            "updatedAt": cart["updated_at"]
+        }
+
+    def _mutate(self, user_id, store_id, change):
+        def apply(cart):
+            change(cart["items"])
+            cart["updated_at"] = datetime.now()
+            cart["dirty"] = True
+            cart["due"] = time.monotonic() + self.debounce_seconds
+            return self._doc(user_id, store_id, cart)
+        return self._with_cart(user_id, store_id, apply)
+
+    # --- Cart operations ---
+
+    def get(self, user_id, store_id):
+        """The cart document, or None if the user has no cart with this store."""
+        def read(cart):
+            if not cart["items"] and cart["updated_at"] is None: return None
+            return self._doc(user_id, store_id, cart)
+        return self._with_cart(user_id, store_id, read)
+
+    def replace(self, user_id, store_id, items_dict):
+        def change(items):
+            items.clear()
+            items.update({pid: int(qty) for pid, qty in items_dict.items()})
+        return self._mutate(user_id, store_id, change)
+
+    def add_item(self, user_id, store_id, product_id, quantity=1):
+        def change(items):
+            items[product_id] = items.get(product_id, 0) + int(quantity)
+            if items[product_id] <= 0: del items[product_id]
+        return self._mutate(user_id, store_id, change)
+
+    def set_quantity(self, user_id, store_id, product_id, quantity):
+        def change(items):
+            if int(quantity) > 0: items[product_id] = int(quantity)
+            else: items.pop(product_id, None)
+        return self._mutate(user_id, store_id, change)
+
+    def remove_item(self, user_id, store_id, product_id):
+        return self._mutate(user_id, store_id, lambda items: items.pop(product_id, None))
+
+    # --- Persistence ---
+
+    def flush(self, force=False):
+        """Writes dirty carts whose debounce deadline passed (all of them if force) and evicts idle carts."""
+        now = time.monotonic()
+        writes = []
+        with self._lock:
+            for key, cart in list(self._carts.items()):
+                idle = self.ttl_seconds is not None and now - cart["touched"] > self.ttl_seconds
+                if cart["dirty"] and (force or idle or cart["due"] <= now):
+                    writes.append((key, self._doc(*key, cart)))
+                    cart["dirty"], cart["due"] = False, None
+                if idle: del self._carts[key]
+
+        # Remote writes happen outside the lock so cart edits never wait on Firestore
+        if not self._remote(): return
+        for key, doc in writes:
+            self.remote_writes += 1
+            if self.fs.add_document("carts", doc, doc_id=self.cart_id(*key)) is None:
+                # Keep the edit around (even if the cart was just evicted) and retry later
+                with self._lock:
+                    cart = self._carts.get(key)
+                    if cart is None:
+                        items = {i["productId"]: i["quantity"] for i in doc["items"]}
+                        cart = self._carts[key] = {"items": items, "updated_at": doc["updatedAt"],
+                                                   "touched": time.monotonic()}
+                    elif cart["dirty"]:
+                        continue
+                    cart["dirty"], cart["due"] = True, time.monotonic() + self.debounce_seconds
+
+    def _run(self):
+        interval = max(0.05, min(self.debounce_seconds / 2, 1.0))
+        while not self._stop.wait(interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Cart flush failed: {e}")
+
+    def close(self):
+        """Stops the flusher and persists every dirty cart."""
+        self._stop.set()
+        self.flush(force=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active_carts": len(self._carts),
+                "dirty_carts": sum(1 for c in self._carts.values() if c["dirty"]),
+                "remote_reads": self.remote_reads,
+                "remote_writes": self.remote_writes
+            }
+
+
+class SharedCartService(CartService):
+    """CartService for several worker processes: active carts live in a table of the shared SQLite database.
+
+    Each edit is a read-modify-write inside one SQLite write transaction, so
+    edits from different workers to the same cart serialize instead of the
+    last debounced flush winning. A cart is seeded from Firestore the first
+    time any worker touches it. Every worker runs a flusher; a dirty cart is
+    claimed (its deadline pushed forward) by one of them before it is
+    written, and only marked clean if nobody edited it in the meantime.
+    """
+
+    TABLE = '_carts'  # leading underscore: not an engine table
+
+    def __init__(self, fs, db_path, ttl_seconds=1800, debounce_seconds=2.0):
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=60.0)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS {self.TABLE} (cart_id TEXT PRIMARY KEY, user_id, store_id, '
+                          'items TEXT, updated_at TEXT, due REAL, touched REAL)')
+        self._conn_lock = threading.Lock()
+        super().__init__(fs, ttl_seconds, debounce_seconds)
+
+    def _row(self, cart_id):
+        return self.conn.execute(f'SELECT items, updated_at FROM {self.TABLE} WHERE cart_id = ?', (cart_id,)).fetchone()
+
+    def _seed(self, user_id, store_id):
+        """Makes sure the cart has a row, loading it from Firestore (outside any lock) if it has none."""
+        cart_id = self.cart_id(user_id, store_id)
+        with self._conn_lock:
+            if self._row(cart_id) is not None: return
+        items, updated_at = self._fetch(user_id, store_id)
+        with self._conn_lock:
+            self.conn.execute(
+                f'INSERT OR IGNORE INTO {self.TABLE} (cart_id, user_id, store_id, items, updated_at, due, touched) '
+                'VALUES (?, ?, ?, ?, ?, NULL, ?)',
+                (cart_id, user_id, store_id, json.dumps(items),
+                 updated_at.isoformat() if isinstance(updated_at, datetime) else updated_at, time.time())
+            )
+
+    @staticmethod
+    def _cart(row):
+        items, updated_at = row
+        return {"items": json.loads(items), "updated_at": datetime.fromisoformat(updated_at) if updated_at else None}
+
+    def _with_cart(self, user_id, store_id, fn):
+        """Runs fn(cart) in a write transaction and stores the cart back if fn marked it dirty."""
+        cart_id = self.cart_id(user_id, store_id)
+        while True:
+            self._seed(user_id, store_id)
+            with self._conn_lock:
+                self.conn.execute('BEGIN IMMEDIATE')
+                try:
+                    row = self._row(cart_id)
+                    if row is None:
+                        # Evicted since it was seeded; seed it again
+                        self.conn.execute('ROLLBACK')
+                        continue
+                    cart = dict(self._cart(row), dirty=False, due=None)
+                    result = fn(cart)
+                    if cart["dirty"]:
+                        self.conn.execute(
+                            f'UPDATE {self.TABLE} SET items = ?, updated_at = ?, due = ?, touched = ? WHERE cart_id = ?',
+                            (json.dumps(cart["items"]), cart["updated_at"].isoformat(),
+                             time.time() + self.debounce_seconds, time.time(), cart_id)
+                        )
+                    self.conn.execute('COMMIT')
+                except BaseException:
+                    self.conn.execute('ROLLBACK')
+                    raise
+            return result
+
+    def get(self, user_id, store_id):
+        """The cart document, or None if the user has no cart with this store."""
+        self._seed(user_id, store_id)
+        with self._conn_lock:
+            row = self._row(self.cart_id(user_id, store_id))
+        # Plain reads skip the write transaction
+        if row is None: return super().get(user_id, store_id)
+        cart = self._cart(row)
+        if not cart["items"] and cart["updated_at"] is None: return None
+        return self._doc(user_id, store_id, cart)
+
+    def flush(self, force=False):
+        """Writes dirty carts whose debounce deadline passed (all of them if force) and evicts idle clean carts."""
+        now = time.time()
+        writes = []
+        with self._conn_lock:
+            rows = self.conn.execute(
+                f'SELECT cart_id, user_id, store_id, items, updated_at, due FROM {self.TABLE} '
+                'WHERE due IS NOT NULL' + ('' if force else ' AND due <= ?'), () if force else (now,)
+            ).fetchall()
+            for cart_id, user_id, store_id, items, updated_at, due in rows:
+                if not self._remote():
+                    self.conn.execute(f'UPDATE {self.TABLE} SET due = NULL WHERE cart_id = ? AND due = ?', (cart_id, due))
+                    continue
+                # Claim the cart so the other workers' flushers skip it; a failed write retries after the debounce
+                claimed = self.conn.execute(f'UPDATE {self.TABLE} SET due = ? WHERE cart_id = ? AND due = ?',
+                                            (now + self.debounce_seconds, cart_id, due)).rowcount
+                if claimed:
+                    writes.append((cart_id, updated_at, self._doc(user_id, store_id, self._cart((items, updated_at)))))
+            if self.ttl_seconds is not None:
+                self.conn.execute(f'DELETE FROM {self.TABLE} WHERE due IS NULL AND touched < ?', (now - self.ttl_seconds,))
+
+        if not self._remote(): return
+        for cart_id, updated_at, doc in writes:
+            self.remote_writes += 1
+            if self.fs.add_document("carts", doc, doc_id=cart_id) is None: continue
+            with self._conn_lock:
+                # Still dirty if it was edited while the write was in flight
+                self.conn.execute(f'UPDATE {self.TABLE} SET due = NULL WHERE cart_id = ? AND updated_at IS ?',
+                                  (cart_id, updated_at))
+
+    def close(self):
+        super().close()
+        self._flusher.join(timeout=30)
+        with self._conn_lock:
+            self.conn.close()
+
+    def stats(self):
+        with self._conn_lock:
+            active, dirty = self.conn.execute(f'SELECT COUNT(*), COUNT(due) FROM {self.TABLE}').fetchone()
+        return {
+            "active_carts": active,
+            "dirty_carts": dirty,
+            "remote_reads": self.remote_reads,
+            "remote_writes": self.remote_writes
+        }
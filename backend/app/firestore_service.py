@@ -2,9 +2,39 @@ import firebase_admin
 from firebase_admin import credentials, firestore
 import os
 from datetime import datetime
+from .write_behind import WriteBehindQueue
+from .activity_log import RecentActivity, ActivityLogSink
+from .memory_firestore import InMemoryFirestore
 
 class FirestoreService:
-    def __init__(self, service_account_key_path=None):
+    # Firestore rejects write batches with more than 500 operations
+    MAX_BATCH_WRITES = 500
+
+    def __init__(self, service_account_key_path=None, client=None, backend=None, write_behind=False,
+                 write_behind_workers=2, write_behind_maxsize=10000, activity_log_path=None, recent_activity=None):
+        """backend selects the client when none is injected: "firebase" (default) or
+        "memory" for the in-process InMemoryFirestore, with FIRESTORE_LATENCY_MS of
+        simulated latency per round trip. Falls back to the FIRESTORE_BACKEND env var.
+        activity_log_path is the local JSON-lines copy of the activity log. recent_activity
+        replaces the in-process ring buffer, e.g. with one shared by several workers.
+        """
+        self.queue = None
+        self.recent_activity = recent_activity if recent_activity is not None else RecentActivity()
+        backend = backend or os.getenv("FIRESTORE_BACKEND", "firebase")
+        if client is None and backend == "memory":
+            client = InMemoryFirestore(latency_seconds=float(os.getenv("FIRESTORE_LATENCY_MS", "0")) / 1000)
+        if client is not None:
+            # Injected client (e.g. an in-process fake); skip Firebase app setup
+            self.db = client
+        else:
+            self._init_client(service_account_key_path)
+        if write_behind and self.db:
+            # Mirror writes off the request path; reads still go to Firestore
+            self.queue = WriteBehindQueue(self._commit_chunk, workers=write_behind_workers,
+                                          maxsize=write_behind_maxsize, batch_size=self.MAX_BATCH_WRITES)
+        self.activity_sink = ActivityLogSink(self._write_activity, activity_log_path)
+
+    def _init_client(self, service_account_key_path):
         if not service_account_key_path:
             # Look for serviceAccountKey.json in the project root
             root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -31,6 +61,11 @@ class FirestoreService:
             print(f"Error: Could not obtain Firestore client. {e}")
             self.db = None
 
+    @property
+    def persistent(self):
+        """False for the in-memory backend, whose contents do not outlive the process."""
+        return self.db is not None and not isinstance(self.db, InMemoryFirestore)
+
     def get_collection(self, collection_name):
         if not self.db: return None
         return self.db.collection(collection_name)
@@ -40,6 +75,11 @@ class FirestoreService:
         try:
             col_ref = self.get_collection(collection)
             if not col_ref: return None
+            if self.queue:
+                # Auto ids are generated client-side, so the id is known before the write lands
+                doc_id = doc_id or col_ref.document().id
+                self.queue.put('set', collection, doc_id, data)
+                return doc_id
             if doc_id:
                 col_ref.document(doc_id).set(data)
                 return doc_id
@@ -53,13 +93,22 @@ class FirestoreService:
     def get_document(self, collection, doc_id):
         col_ref = self.get_collection(collection)
         if not col_ref: return None
+        queued = self.queue.pending_write(collection, doc_id) if self.queue else None
+        if queued is not None:
+            op, data = queued
+            if op == 'set': return data
+            if op == 'delete': return None
         doc = col_ref.document(doc_id).get()
-        return doc.to_dict() if doc.exists else None
+        current = doc.to_dict() if doc.exists else None
+        if queued is not None and current is not None:
+            current.update(queued[1])  # unflushed update on top of the stored document
+        return current
 
     def update_document(self, collection, doc_id, data):
         try:
             col_ref = self.get_collection(collection)
             if not col_ref: return False
+            if self.queue: return self.queue.put('update', collection, doc_id, data)
             col_ref.document(doc_id).update(data)
             return True
         except Exception as e:
@@ -71,6 +120,7 @@ class FirestoreService:
         try:
             col_ref = self.get_collection(collection)
             if not col_ref: return False
+            if self.queue: return self.queue.put('delete', collection, doc_id)
             col_ref.document(doc_id).delete()
             return True
         except Exception as e:
@@ -87,18 +137,102 @@ class FirestoreService:
         docs = query.stream()
         return [doc.to_dict() | {"id": doc.id} for doc in docs]
 
+    def query_latest(self, collection, order_field, limit, before=None):
+        """Newest `limit` documents by order_field, ordered and limited server-side."""
+        col_ref = self.get_collection(collection)
+        if not col_ref: return []
+        query = col_ref
+        if before is not None:
+            query = query.where(order_field, "<", before)
+        docs = query.order_by(order_field, direction="DESCENDING").limit(limit).stream()
+        return [doc.to_dict() | {"id": doc.id} for doc in docs]
+
+    def commit_batch(self, writes):
+        """Commit (op, collection, doc_id, data) writes in as few batches as possible.
+
+        op is 'set', 'update', 'delete' or 'add' (set on an auto-generated id).
+        Up to MAX_BATCH_WRITES writes commit atomically; larger lists are split
+        into consecutive batches that each commit atomically on their own.
+        Returns True only if every batch committed.
+
+        With write-behind enabled the writes are queued instead and True means
+        they were accepted; the queue regroups them into batches, so writes
+        spanning several batches are no longer committed together.
+        """
+        if not self.db or not writes: return False
+        if self.queue:
+            return all([self.queue.put(op, collection, doc_id, data) for op, collection, doc_id, data in writes])
+        ok = True
+        for start in range(0, len(writes), self.MAX_BATCH_WRITES):
+            ok = self._commit_chunk(writes[start:start + self.MAX_BATCH_WRITES]) and ok
+        return ok
+
+    def _commit_chunk(self, writes):
+        try:
+            batch = self.db.batch()
+            for op, collection, doc_id, data in writes:
+                col_ref = self.db.collection(collection)
+                if op == 'set':
+                    batch.set(col_ref.document(doc_id), data)
+                elif op == 'add':
+                    batch.set(col_ref.document(), data)
+                elif op == 'update':
+                    batch.update(col_ref.document(doc_id), data)
+                elif op == 'delete':
+                    batch.delete(col_ref.document(doc_id))
+            batch.commit()
+            return True
+        except Exception as e:
+            print(f"Firestore commit_batch error: {e}")
+            return False
+
+    def commit_batch_and_wait(self, writes, timeout=None):
+        """Like commit_batch, but with write-behind enabled waits until the writes have landed.
+
+        Returns True only if no write failed in the meantime.
+        """
+        if not self.queue: return self.commit_batch(writes)
+        failed_before = self.queue.failed
+        if not self.commit_batch(writes): return False
+        return self.queue.flush(timeout) and self.queue.failed == failed_before
+
+    def flush(self, timeout=None):
+        """Flushes buffered activity logs and waits until queued write-behind writes have been committed."""
+        self.activity_sink.flush()
+        return self.queue.flush(timeout) if self.queue else True
+
+    def close(self, timeout=30):
+        """Flushes the activity sink, then flushes and stops the write-behind workers."""
+        self.activity_sink.close()
+        return self.queue.close(timeout) if self.queue else True
+
+    def queue_stats(self):
+        return self.queue.stats() if self.queue else {"enabled": False}
+
     # Schema-specific helpers
-    def log_activity(self, actor_id, role, action):
-        self.add_document("activity_logs", {
+    @staticmethod
+    def activity_doc(actor_id, role, action):
+        return {
             "actorId": actor_id,
             "actorRole": role,
             "action": action,
             "timestamp": datetime.now()
-        })
+        }
 
-    def sync_user(self, user_id, data):
+    def log_activity(self, actor_id, role, action):
+        """Records an event locally right away; the sink mirrors it to Firestore in batches."""
+        doc = self.activity_doc(actor_id, role, action)
+        self.recent_activity.append(doc)
+        self.activity_sink.log(doc)
+
+    def _write_activity(self, docs):
+        if not self.db: return False
+        return self.commit_batch([('add', 'activity_logs', None, doc) for doc in docs])
+
+    @staticmethod
+    def user_doc(data):
         # Ensure schema compliance
-        schema_data = {
+        return {
             "name": data.get("name"),
             "email": data.get("email", ""),
             "role": data.get("role", "user"),
@@ -106,10 +240,10 @@ class FirestoreService:
             "totalOrders": data.get("totalOrders", 0),
             "totalReturns": data.get("totalReturns", 0)
         }
-        self.add_document("users", schema_data, doc_id=user_id)
 
-    def sync_product(self, product_id, data):
-        schema_data = {
+    @staticmethod
+    def product_doc(data):
+        return {
             "storeId": data.get("storeId", "S001"),
             "retailerId": data.get("retailerId"),
             "productName": data.get("name"),
@@ -122,4 +256,9 @@ class FirestoreService:
             "salesCount": data.get("salesCount", 0),
             "createdAt": datetime.now()
         }
-        self.add_document("products", schema_data, doc_id=product_id)
+
+    def sync_user(self, user_id, data):
+        self.add_document("users", self.user_doc(data), doc_id=user_id)
+
+    def sync_product(self, product_id, data):
+        self.add_document("products", self.product_doc(data), doc_id=product_id)
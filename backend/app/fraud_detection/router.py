@@ -17,6 +17,7 @@ from .services.image_service import ImageService
 from .services.fraud_detection_service import FraudDetectionService
 from .services.decision_engine import DecisionEngine
 from .utils.storage import StorageManager
+from .utils.work_pool import WorkPool, PoolBusyError
 
 # Initialize API Router
 router = APIRouter(
@@ -26,7 +27,8 @@ router = APIRouter(
 
 # Initialize services
 storage_manager = StorageManager()
-image_service = ImageService(storage_manager)
+work_pool = WorkPool.from_env()  # blocking image/disk work runs here, off the event loop
+image_service = ImageService(storage_manager, work_pool)
 fraud_detection_service = FraudDetectionService()
 decision_engine = DecisionEngine(fraud_detection_service)
 
@@ -37,10 +39,17 @@ async def root():
     return {
         "status": "active",
         "service": "Return Product Fraud Detection System",
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "work_pool": work_pool.stats()
     }
 
 
+@router.on_event("shutdown")
+def shutdown_work_pool():
+    """Let running image jobs finish and stop the pool workers"""
+    work_pool.shutdown()
+
+
 @router.post("/delivery-confirmation", response_model=DeliveryConfirmationResponse)
 async def delivery_confirmation(
     order_id: str = Form(...),
@@ -83,6 +92,8 @@ async def delivery_confirmation(
             image_path=result["image_path"]
         )
         
+    except PoolBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -123,7 +134,7 @@ async def request_return(
             )
         
         # STEP 1: Check if delivery image exists (MANDATORY)
-        delivery_record = storage_manager.get_delivery_record(order_id)
+        delivery_record = await work_pool.run(storage_manager.get_delivery_record, order_id)
         if not delivery_record:
             return ReturnRequestResponse(
                 status="rejected",
@@ -142,7 +153,8 @@ async def request_return(
         )
         
         # STEP 2: Process return through decision engine
-        decision_result = await decision_engine.process_return_request(
+        decision_result = await work_pool.run(
+            decision_engine.evaluate_return_request,
             order_id=order_id,
             return_reason=return_reason,
             product_category=product_category,
@@ -160,6 +172,8 @@ async def request_return(
             authenticity_details=decision_result.get("authenticity_details")
         )
         
+    except PoolBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -176,8 +190,8 @@ async def get_order_status(order_id: str):
         Order status details
     """
     try:
-        delivery_record = storage_manager.get_delivery_record(order_id)
-        return_record = storage_manager.get_return_record(order_id)
+        delivery_record = await work_pool.run(storage_manager.get_delivery_record, order_id)
+        return_record = await work_pool.run(storage_manager.get_return_record, order_id)
         
         return {
             "order_id": order_id,
@@ -187,6 +201,8 @@ async def get_order_status(order_id: str):
             "return_details": return_record
         }
         
+    except PoolBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
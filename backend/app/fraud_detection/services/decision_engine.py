@@ -38,6 +38,29 @@ class DecisionEngine:
     ) -> dict:
         """
         Process return request and make final decision.
+        Runs on the calling event loop; see evaluate_return_request.
+        """
+        return self.evaluate_return_request(
+            order_id=order_id,
+            return_reason=return_reason,
+            product_category=product_category,
+            time_since_delivery=time_since_delivery,
+            return_image_path=return_image_path,
+            delivery_record=delivery_record
+        )
+    
+    def evaluate_return_request(
+        self,
+        order_id: str,
+        return_reason: str,
+        product_category: str,
+        time_since_delivery: int,
+        return_image_path: str,
+        delivery_record: dict
+    ) -> dict:
+        """
+        Process return request and make final decision (blocking: reads the
+        image metadata from disk). Safe to run in a thread or process pool.
         
         Args:
             order_id: Order identifier
@@ -4,19 +4,47 @@ Image Service - Handles image upload, storage, and processing
 
 from fastapi import UploadFile
 from datetime import datetime
+from typing import BinaryIO, Callable, Optional, Tuple
 import hashlib
 import os
 from PIL import Image
-import io
 
 from ..utils.storage import StorageManager
+from ..utils.work_pool import WorkPool
 
 
 class ImageService:
-    """Service for handling image operations"""
+    """
+    Service for handling image operations.
+
+    Uploads are streamed: read in CHUNK_SIZE pieces, hashed incrementally
+    and appended to a temporary file that is renamed into storage once
+    complete, so memory per upload stays constant whatever its size.
+    
+    Disk writes, hashing and image decoding are blocking work; with a
+    work_pool they run there instead of on the event loop. Copying an upload
+    is one threaded job per upload, as the open upload file cannot be sent to
+    another process; the other blocking steps are static methods so they also
+    run in a process pool.
+    """
+    
+    CHUNK_SIZE = 1024 * 1024  # bytes read from the upload at a time
     
-    def __init__(self, storage_manager: StorageManager):
+    def __init__(self, storage_manager: StorageManager, work_pool: Optional[WorkPool] = None):
         self.storage_manager = storage_manager
+        self.work_pool = work_pool
+    
+    async def _run(self, fn: Callable, *args):
+        """Run blocking work in the work pool, or inline without one"""
+        if self.work_pool is None:
+            return fn(*args)
+        return await self.work_pool.run(fn, *args)
+    
+    async def _run_io(self, fn: Callable, *args):
+        """Run blocking I/O in a work pool thread, or inline without a pool"""
+        if self.work_pool is None:
+            return fn(*args)
+        return await self.work_pool.run_io(fn, *args)
     
     async def save_delivery_image(
         self,
@@ -35,42 +63,17 @@ class ImageService:
         Returns:
             Dictionary with image path, timestamp, and metadata
         """
-        # Read image content
-        image_content = await image_file.read()
+        temp_path, image_hash = await self._stream_upload(image_file, order_id)
         
-        # Calculate hash for duplicate detection
-        image_hash = self._calculate_hash(image_content)
-        
-        # Extract metadata
-        metadata = self._extract_metadata(image_content)
-        
-        # Save image to storage
-        image_path = self.storage_manager.save_image(
-            image_content,
+        return await self._finish(
+            ImageService._store_delivery_image,
+            temp_path,
+            self.storage_manager,
+            temp_path,
+            image_hash,
             order_id,
-            "delivery"
+            product_category
         )
-        
-        # Create delivery record
-        timestamp = datetime.now().isoformat()
-        delivery_record = {
-            "order_id": order_id,
-            "product_category": product_category,
-            "delivery_timestamp": timestamp,
-            "image_path": image_path,
-            "image_hash": image_hash,
-            "image_metadata": metadata
-        }
-        
-        # Save record
-        self.storage_manager.save_delivery_record(order_id, delivery_record)
-        
-        return {
-            "image_path": image_path,
-            "timestamp": timestamp,
-            "image_hash": image_hash,
-            "metadata": metadata
-        }
     
     async def save_return_image(
         self,
@@ -87,21 +90,96 @@ class ImageService:
         Returns:
             Dictionary with image path and metadata
         """
-        # Read image content
-        image_content = await image_file.read()
+        temp_path, image_hash = await self._stream_upload(image_file, order_id)
         
-        # Calculate hash
-        image_hash = self._calculate_hash(image_content)
+        return await self._finish(
+            ImageService._store_image,
+            temp_path,
+            self.storage_manager,
+            temp_path,
+            image_hash,
+            order_id,
+            "return"
+        )
+    
+    async def _stream_upload(self, image_file: UploadFile, order_id: str) -> Tuple[str, str]:
+        """
+        Copy an upload to a temporary file in storage, hashing it on the way.
         
-        # Extract metadata
-        metadata = self._extract_metadata(image_content)
+        Args:
+            image_file: Uploaded image file
+            order_id: Order identifier
         
-        # Save image to storage
-        image_path = self.storage_manager.save_image(
-            image_content,
+        Returns:
+            Tuple of (temporary file path, SHA-256 hex digest)
+        """
+        return await self._run_io(
+            ImageService._copy_upload,
+            self.storage_manager,
+            image_file.file,
             order_id,
-            "return"
+            self.CHUNK_SIZE
         )
+    
+    async def _finish(self, fn: Callable, temp_path: str, *args) -> dict:
+        """Run a store step on a streamed upload, removing the temporary file if it fails"""
+        try:
+            return await self._run(fn, *args)
+        except BaseException:
+            self.storage_manager.discard_image(temp_path)
+            raise
+    
+    @staticmethod
+    def _copy_upload(
+        storage_manager: StorageManager,
+        source: BinaryIO,
+        order_id: str,
+        chunk_size: int
+    ) -> Tuple[str, str]:
+        """
+        Copy an upload to a new temporary image file chunk by chunk, hashing
+        each chunk as it is written, and sync it to disk (blocking).
+        
+        Returns:
+            Tuple of (temporary file path, SHA-256 hex digest)
+        """
+        temp_path = storage_manager.create_temp_image(order_id)
+        hasher = hashlib.sha256()
+        try:
+            with open(temp_path, 'wb') as f:
+                while True:
+                    chunk = source.read(chunk_size)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    f.write(chunk)
+                # On the write handle: Windows cannot fsync a read-only one
+                f.flush()
+                os.fsync(f.fileno())
+        except BaseException:
+            storage_manager.discard_image(temp_path)
+            raise
+        return temp_path, hasher.hexdigest()
+    
+    @staticmethod
+    def _store_image(
+        storage_manager: StorageManager,
+        temp_path: str,
+        image_hash: str,
+        order_id: str,
+        image_type: str
+    ) -> dict:
+        """
+        Move a streamed upload into storage and extract its metadata (blocking).
+        
+        Returns:
+            Dictionary with image path, hash and metadata
+        """
+        # Save image to storage
+        image_path = storage_manager.commit_image(temp_path, order_id, image_type)
+        
+        # Extract metadata from the stored file
+        metadata = ImageService._extract_metadata(image_path)
         
         return {
             "image_path": image_path,
@@ -109,52 +187,79 @@ class ImageService:
             "metadata": metadata
         }
     
-    def _calculate_hash(self, image_content: bytes) -> str:
+    @staticmethod
+    def _store_delivery_image(
+        storage_manager: StorageManager,
+        temp_path: str,
+        image_hash: str,
+        order_id: str,
+        product_category: str
+    ) -> dict:
         """
-        Calculate SHA-256 hash of image for duplicate detection.
-        
-        Args:
-            image_content: Raw image bytes
+        Save a delivery image and its delivery record (blocking).
         
         Returns:
-            Hexadecimal hash string
+            Dictionary with image path, timestamp, hash and metadata
         """
-        return hashlib.sha256(image_content).hexdigest()
+        result = ImageService._store_image(storage_manager, temp_path, image_hash, order_id, "delivery")
+        
+        # Create delivery record
+        timestamp = datetime.now().isoformat()
+        delivery_record = {
+            "order_id": order_id,
+            "product_category": product_category,
+            "delivery_timestamp": timestamp,
+            "image_path": result["image_path"],
+            "image_hash": result["image_hash"],
+            "image_metadata": result["metadata"]
+        }
+        
+        # Save record
+        storage_manager.save_delivery_record(order_id, delivery_record)
+        
+        return {
+            "image_path": result["image_path"],
+            "timestamp": timestamp,
+            "image_hash": result["image_hash"],
+            "metadata": result["metadata"]
+        }
     
-    def _extract_metadata(self, image_content: bytes) -> dict:
+    @staticmethod
+    def _extract_metadata(image_path: str) -> dict:
         """
-        Extract metadata from image including resolution, size, format.
+        Extract metadata from an image file including resolution, size, format.
+        Only the image header is decoded, not the pixel data.
         
         Args:
-            image_content: Raw image bytes
+            image_path: Path to the stored image
         
         Returns:
             Dictionary with image metadata
         """
+        file_size = os.path.getsize(image_path)
         try:
             # Open image using PIL
-            image = Image.open(io.BytesIO(image_content))
-            
-            # Extract EXIF data if available
-            exif_data = image.getexif() if hasattr(image, 'getexif') else {}
-            
-            metadata = {
-                "format": image.format,
-                "mode": image.mode,
-                "width": image.width,
-                "height": image.height,
-                "resolution": f"{image.width}x{image.height}",
-                "file_size_bytes": len(image_content),
-                "file_size_kb": round(len(image_content) / 1024, 2),
-                "has_exif": len(exif_data) > 0,
-                "exif_tags_count": len(exif_data)
-            }
+            with Image.open(image_path) as image:
+                # Extract EXIF data if available
+                exif_data = image.getexif() if hasattr(image, 'getexif') else {}
+                
+                metadata = {
+                    "format": image.format,
+                    "mode": image.mode,
+                    "width": image.width,
+                    "height": image.height,
+                    "resolution": f"{image.width}x{image.height}",
+                    "file_size_bytes": file_size,
+                    "file_size_kb": round(file_size / 1024, 2),
+                    "has_exif": len(exif_data) > 0,
+                    "exif_tags_count": len(exif_data)
+                }
             
             return metadata
             
         except Exception as e:
             return {
                 "error": str(e),
-                "file_size_bytes": len(image_content),
-                "file_size_kb": round(len(image_content) / 1024, 2)
+                "file_size_bytes": file_size,
+                "file_size_kb": round(file_size / 1024, 2)
             }
@@ -4,6 +4,7 @@ Storage Manager - Local file storage for images and metadata
 
 import os
 import json
+import tempfile
 from datetime import datetime
 from typing import Optional, Dict
 
@@ -48,6 +49,66 @@ class StorageManager:
         Returns:
             Path to saved image
         """
+        filepath = self._new_image_path(order_id, image_type)
+        
+        # Save image
+        with open(filepath, 'wb') as f:
+            f.write(image_content)
+        
+        return filepath
+    
+    def create_temp_image(self, order_id: str) -> str:
+        """
+        Create an empty temporary file for an image being uploaded.
+        
+        It lives in the order's image directory, so commit_image can move it
+        into place with an atomic rename.
+        
+        Args:
+            order_id: Order identifier
+        
+        Returns:
+            Path to the temporary file
+        """
+        order_dir = os.path.join(self.images_path, order_id)
+        os.makedirs(order_dir, exist_ok=True)
+        
+        fd, temp_path = tempfile.mkstemp(prefix=".upload_", suffix=".part", dir=order_dir)
+        os.close(fd)
+        return temp_path
+    
+    def commit_image(self, temp_path: str, order_id: str, image_type: str) -> str:
+        """
+        Rename a fully written temporary image into place.
+        
+        The writer must have flushed and fsynced the file first.
+        
+        Args:
+            temp_path: Path returned by create_temp_image
+            order_id: Order identifier
+            image_type: Type of image ('delivery' or 'return')
+        
+        Returns:
+            Path to saved image
+        """
+        filepath = self._new_image_path(order_id, image_type)
+        os.replace(temp_path, filepath)
+        return filepath
+    
+    def discard_image(self, temp_path: str):
+        """
+        Remove a temporary image left by a failed upload.
+        
+        Args:
+            temp_path: Path returned by create_temp_image
+        """
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+    
+    def _new_image_path(self, order_id: str, image_type: str) -> str:
+        """Timestamped path for a new image in the order's directory"""
         # Create order-specific directory
         order_dir = os.path.join(self.images_path, order_id)
         os.makedirs(order_dir, exist_ok=True)
@@ -55,13 +116,7 @@ class StorageManager:
         # Generate filename with timestamp
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f"{image_type}_{timestamp}.jpg"
-        filepath = os.path.join(order_dir, filename)
-        
-        # Save image
-        with open(filepath, 'wb') as f:
-            f.write(image_content)
-        
-        return filepath
+        return os.path.join(order_dir, filename)
     
     def save_delivery_record(self, order_id: str, record: dict):
         """
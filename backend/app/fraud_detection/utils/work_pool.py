@@ -0,0 +1,139 @@
+"""
+Work Pool - Runs blocking image and disk work off the event loop
+"""
+
+import asyncio
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+
+class PoolBusyError(RuntimeError):
+    """Raised when no slot in the work pool frees up within the queue timeout"""
+
+
+class WorkPool:
+    """
+    Thread or process pool for the synchronous parts of the fraud endpoints
+    (image decoding, hashing, image and JSON file writes).
+
+    At most max_pending jobs are queued or running at once. Further callers
+    wait up to queue_timeout seconds for a slot and then get PoolBusyError,
+    so a burst of uploads applies backpressure instead of queueing without bound.
+
+    A process pool can only run picklable callables: module-level functions,
+    static methods, or bound methods of picklable objects. Work on objects
+    that cannot cross a process boundary, such as an open upload file, goes
+    through run_io(), which always uses threads and shares the same slots.
+    """
+
+    KINDS = ("thread", "process")
+
+    def __init__(
+        self,
+        kind: str = "thread",
+        workers: Optional[int] = None,
+        max_pending: Optional[int] = None,
+        queue_timeout: float = 30.0
+    ):
+        """
+        Initialize the work pool.
+
+        Args:
+            kind: 'thread' (default) or 'process'
+            workers: Number of worker threads/processes (default: CPU count)
+            max_pending: Maximum jobs queued or running (default: 4 per worker)
+            queue_timeout: Seconds to wait for a free slot before giving up
+        """
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown work pool kind: {kind}")
+        self.kind = kind
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 4
+        self.queue_timeout = queue_timeout
+
+        if kind == "process":
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            self._io_executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="fraud-io")
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="fraud-work")
+            self._io_executor = self._executor
+
+        # Created on first use so it binds to the server's event loop
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    @classmethod
+    def from_env(cls) -> "WorkPool":
+        """
+        Build a pool from FRAUD_POOL_KIND, FRAUD_POOL_WORKERS,
+        FRAUD_POOL_MAX_PENDING and FRAUD_POOL_QUEUE_TIMEOUT.
+        """
+        workers = os.getenv("FRAUD_POOL_WORKERS")
+        max_pending = os.getenv("FRAUD_POOL_MAX_PENDING")
+        return cls(
+            kind=os.getenv("FRAUD_POOL_KIND", "thread"),
+            workers=int(workers) if workers else None,
+            max_pending=int(max_pending) if max_pending else None,
+            queue_timeout=float(os.getenv("FRAUD_POOL_QUEUE_TIMEOUT", "30"))
+        )
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Run fn(*args, **kwargs) in the pool and await its result.
+
+        Raises:
+            PoolBusyError: If no slot frees up within queue_timeout seconds
+        """
+        return await self._submit(self._executor, fn, *args, **kwargs)
+
+    async def run_io(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Run fn(*args, **kwargs) in a worker thread and await its result,
+        whatever the pool kind. For blocking I/O on unpicklable arguments.
+
+        Raises:
+            PoolBusyError: If no slot frees up within queue_timeout seconds
+        """
+        return await self._submit(self._io_executor, fn, *args, **kwargs)
+
+    async def _submit(self, executor, fn: Callable, *args, **kwargs) -> Any:
+        """Wait for a slot, then run fn in the given executor"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise PoolBusyError(
+                f"Image processing queue is full ({self.max_pending} jobs pending); try again shortly"
+            )
+
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+        finally:
+            self.pending -= 1
+            self.completed += 1
+            self._slots.release()
+
+    def stats(self) -> dict:
+        """Current pool configuration and counters"""
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "completed": self.completed,
+            "rejected": self.rejected
+        }
+
+    def shutdown(self):
+        """Wait for running jobs and stop the workers"""
+        self._executor.shutdown(wait=True)
+        if self._io_executor is not self._executor:
+            self._io_executor.shutdown(wait=True)
@@ -0,0 +1,126 @@
+import bisect
+
+import numpy as np
+
+
+class PrimaryKeyIndex:
+    """Hash index from a table's primary key to its row position.
+
+    The engine keeps its frames on a RangeIndex, so a position is also the row
+    label usable with .at/.loc. Appends extend the index in O(rows added);
+    deletes shift positions and rebuild it.
+
+    Copies share the bulk of the mapping: keys added after a copy go to a
+    small overlay, which is merged into a new shared base once it grows past
+    MAX_OVERLAY keys. Copying an index is therefore O(overlay), not O(rows).
+    """
+
+    MAX_OVERLAY = 1024
+
+    def __init__(self, key_col):
+        self.key_col = key_col
+        self._base = {}  # shared between copies, never changed in place
+        self._added = {}  # keys added since the base was last merged
+
+    def build(self, frame):
+        positions = {}
+        if not frame.empty and self.key_col in frame.columns:
+            # Earlier rows win on duplicate keys, matching the first-match lookups it replaces
+            for pos, key in enumerate(frame[self.key_col].tolist()):
+                positions.setdefault(key, pos)
+        self._base, self._added = positions, {}
+
+    def add(self, keys, start):
+        """Registers keys appended at positions start, start + 1, ..."""
+        for offset, key in enumerate(keys):
+            if key not in self._base: self._added.setdefault(key, start + offset)
+
+    def copy(self):
+        clone = PrimaryKeyIndex(self.key_col)
+        if len(self._added) > self.MAX_OVERLAY:
+            clone._base = {**self._base, **self._added}
+        else:
+            clone._base, clone._added = self._base, dict(self._added)
+        return clone
+
+    def get(self, key):
+        pos = self._added.get(key)
+        return pos if pos is not None else self._base.get(key)
+
+    def __contains__(self, key):
+        return key in self._added or key in self._base
+
+    def __len__(self):
+        return len(self._base) + len(self._added)
+
+
+class GroupIndex:
+    """Secondary index from a foreign key to the positions of all rows carrying it.
+
+    Positions within a group stay in ascending (insertion) order, so slicing a
+    frame with them preserves the table order of a boolean-mask filter.
+
+    Copies share the group lists and the mapping of untouched groups. Groups
+    changed after a copy go to an overlay (each list copied on its first
+    change), which is merged into a new shared base once it grows past
+    MAX_OVERLAY groups.
+    """
+
+    MAX_OVERLAY = 1024
+
+    def __init__(self, key_col):
+        self.key_col = key_col
+        self._base = {}  # key -> positions; shared between copies, never changed in place
+        self._groups = {}  # changed groups; an empty list hides a base group
+        self._owned = set()  # keys whose overlay list this index may change in place
+
+    def build(self, frame):
+        groups = {}
+        if not frame.empty and self.key_col in frame.columns:
+            for key, positions in frame.groupby(self.key_col, sort=False).indices.items():
+                groups[key] = positions.tolist()
+        self._base, self._groups, self._owned = groups, {}, set()
+
+    def copy(self):
+        clone = GroupIndex(self.key_col)
+        if len(self._groups) > self.MAX_OVERLAY:
+            clone._base = {key: group for key, group in {**self._base, **self._groups}.items() if group}
+        else:
+            clone._base, clone._groups = self._base, dict(self._groups)
+        self._owned.clear()
+        return clone
+
+    def _lookup(self, key):
+        group = self._groups.get(key)
+        return group if group is not None else self._base.get(key, ())
+
+    def _group(self, key):
+        """The group list of key, copied into the overlay first if it is shared."""
+        if key not in self._owned:
+            self._groups[key] = list(self._lookup(key))
+            self._owned.add(key)
+        return self._groups[key]
+
+    def add(self, keys, start):
+        """Registers rows appended at positions start, start + 1, ..."""
+        for offset, key in enumerate(keys):
+            self._group(key).append(start + offset)
+
+    def move(self, position, old_key, new_key):
+        """Moves one row between groups after its key column was updated in place."""
+        if old_key == new_key: return
+        if position in self._lookup(old_key):
+            self._group(old_key).remove(position)
+        bisect.insort(self._group(new_key), position)
+
+    def get(self, key):
+        return np.asarray(self._lookup(key), dtype=np.intp)
+
+    def get_many(self, keys):
+        """Positions of the rows of several keys, in table order."""
+        parts = [group for group in map(self._lookup, keys) if group]
+        if not parts: return np.zeros(0, dtype=np.intp)
+        return np.sort(np.concatenate([np.asarray(p, dtype=np.intp) for p in parts]))
+
+    def keys(self):
+        return [key for key in {**self._base, **self._groups} if self._lookup(key)]
@@ -3,160 +3,718 @@ import numpy as np
 import os
 import json
 import hashlib
+import threading
+import uuid
 from datetime import datetime, timedelta
 from PIL import Image
 from .fraud_detection.services.fraud_detection_service import FraudDetectionService
 from .firestore_service import FirestoreService
+from .affinity import AffinityMatrix
+from .popularity import PopularityIndex
+from .result_cache import VersionedLRUCache
+from .table_store import TableStore, StoreLockedError
+from .sqlite_store import SQLiteStore, migrate_csv
+from .indexes import PrimaryKeyIndex, GroupIndex
+from .velocity import SalesVelocity
+from .trust import TrustScores
+from .cart_service import CartService, SharedCartService
+from .activity_log import SharedRecentActivity
+from .snapshot import EngineSnapshot, reads, writes, writing
+
+
+def _table(name):
+    """Engine attribute backed by the calling thread's snapshot; assigning it replaces the table in a writer."""
+    return property(lambda self: self._frame(name),
+                    lambda self, frame: self._replace_table(name, frame))
+
+
+def _derived(name):
+    """Derived store of the calling thread's snapshot; assigning it swaps in a rebuilt store in a writer."""
+    return property(lambda self: self._view().derived[name],
+                    lambda self, store: self._replace_derived(name, store))
+
 
 class RecommendationEngine:
-    def __init__(self, data_dir='data', use_firestore=True):
+    # Tables persisted through the write-ahead log, with their primary key column
+    TABLE_KEYS = {
+        'users': 'user_id',
+        'products': 'product_id',
+        'interactions': None,
+        'retailers': 'retailer_id',
+        'orders': 'order_id',
+        'survey_responses': 'user_id',
+        'support_tickets': 'ticket_id',
+        'return_requests': 'request_id'
+    }
+    # Tables loaded from storage: the logged ones plus the read-only return-risk reference data
+    STORED_TABLES = list(TABLE_KEYS) + ['returns']
+    # Database file of the SQLite storage backend, inside data_dir
+    SQLITE_FILE = 'engine.db'
+    # Tables mirrored to the Firestore collection of the same name at startup
+    SYNC_TABLES = ['users', 'retailers', 'products', 'orders']
+    # Foreign-key columns with a secondary index: table -> columns
+    GROUP_KEYS = {
+        'products': ['retailer_id'],
+        'orders': ['retailer_id', 'user_id'],
+        'interactions': ['user_id'],
+        'return_requests': ['user_id', 'retailer_id', 'status']
+    }
+    # Orders flattened to one row per purchased product; parsed from items_json to build the sales velocity
+    ORDER_ITEM_COLUMNS = ['order_id', 'retailer_id', 'product_id', 'qty', 'unit_price']
+    # Row updates a writer keeps as patches before merging them into its own copy of the frame
+    MAX_ROW_PATCHES = 1024
+
+    users = _table('users')
+    products = _table('products')
+    interactions = _table('interactions')
+    returns = _table('returns')
+    survey_responses = _table('survey_responses')
+    retailers = _table('retailers')
+    orders = _table('orders')
+    support_tickets = _table('support_tickets')
+    return_requests = _table('return_requests')
+
+    affinity = _derived('affinity')
+    popularity = _derived('popularity')
+    velocity = _derived('velocity')
+    trust = _derived('trust')
+
+    def __init__(self, data_dir='data', use_firestore=True, popularity_half_life_days=14, rec_cache_size=1024,
+                 compact_interval=60, firestore_client=None, firestore_backend=None, firestore_write_behind=False,
+                 background_sync=False, storage='csv', change_feed_interval=1.0):
+        """storage selects where tables persist: "csv" (CSV snapshots plus write-ahead logs)
+        or "sqlite" (one SQLite database, created from the CSVs on first start). Several
+        worker processes can share the SQLite storage; each polls for the others' commits
+        every change_feed_interval seconds."""
         self.data_dir = data_dir
         self.use_firestore = use_firestore
-        self.fs = FirestoreService() if use_firestore else None
-        
-        self.users = pd.DataFrame()
-        self.products = pd.DataFrame()
-        self.interactions = pd.DataFrame()
-        self.returns = pd.DataFrame()
-        self.survey_responses = pd.DataFrame()
-        self.retailers = pd.DataFrame()
-        self.orders = pd.DataFrame()
-        self.support_tickets = pd.DataFrame()
+        self.storage = storage
+        if storage == 'sqlite':
+            self.store = SQLiteStore(os.path.join(data_dir, self.SQLITE_FILE), self.TABLE_KEYS, self.GROUP_KEYS)
+        elif storage == 'csv':
+            self.store = TableStore(data_dir, self.TABLE_KEYS)
+        else:
+            raise ValueError(f"Unknown storage backend: {storage}")
         self.categories = ['Beverages', 'Junk', 'Healthy', 'Essentials']
+        # Readers work on the published snapshot while a single writer at a time builds the next one
+        tables = {table: pd.DataFrame() for table in list(self.TABLE_KEYS) + ['returns']}
+        self._local = threading.local()
+        self._snapshot = EngineSnapshot(
+            tables,
+            {table: PrimaryKeyIndex(key) for table, key in self.TABLE_KEYS.items() if key},
+            {table: {col: GroupIndex(col) for col in cols} for table, cols in self.GROUP_KEYS.items()},
+            {
+                'affinity': AffinityMatrix(self.categories),
+                'popularity': PopularityIndex(popularity_half_life_days),
+                'velocity': SalesVelocity(),
+                'trust': TrustScores()
+            }
+        )
+        self.compact_interval = compact_interval
+        self.background_sync = background_sync
+        self._sync_thread = None
+        self.change_feed_interval = change_feed_interval
+        self._change_thread = None
+        self._stop_changes = threading.Event()
+        # The admin log view pages the newest activity of every worker sharing the database
+        self.fs = FirestoreService(
+            client=firestore_client, backend=firestore_backend, write_behind=firestore_write_behind,
+            activity_log_path=os.path.join(data_dir, 'activity_log.jsonl'),
+            recent_activity=SharedRecentActivity(os.path.join(data_dir, self.SQLITE_FILE)) if storage == 'sqlite' else None
+        ) if use_firestore else None
+        # Carts of several workers must live in the shared database; one process keeps them in memory
+        if storage == 'sqlite':
+            self.carts = SharedCartService(self.fs, os.path.join(data_dir, self.SQLITE_FILE))
+        else:
+            self.carts = CartService(self.fs)
+
+        # Recency is day-granular, so a short TTL bounds drift for idle entries
+        self.rec_cache = VersionedLRUCache(maxsize=rec_cache_size, ttl_seconds=300)
         self.fraud_service = FraudDetectionService()
         self.shelf_layout = []
         
     def load_data(self):
-        """Loads data from CSV files."""
+        """Loads the tables from storage (CSV snapshots plus the replayed write-ahead log, or SQLite)."""
         try:
-            # Users
-            user_path = os.path.join(self.data_dir, 'users.csv')
-            if os.path.exists(user_path):
-                self.users = pd.read_csv(user_path).fillna("")
-                if 'password' not in self.users.columns:
-                    self.users['password'] = 'pass123' 
-            else:
-                self.users = pd.DataFrame(columns=['user_id', 'name', 'password', 'active', 'join_date'])
-
-            # Products
-            prod_path = os.path.join(self.data_dir, 'products.csv')
-            if os.path.exists(prod_path):
-                self.products = pd.read_csv(prod_path).fillna(0)
-                if 'active' not in self.products.columns:
-                    self.products['active'] = True
-            else:
-                self.products = pd.DataFrame(columns=['product_id', 'retailer_id', 'name', 'category', 'price', 'stock_count', 'discount_pct', 'active'])
-            
-            # Interactions
-            int_path = os.path.join(self.data_dir, 'interactions.csv')
-            if os.path.exists(int_path):
-                 self.interactions = pd.read_csv(int_path).fillna("")
-                 self.interactions['timestamp'] = pd.to_datetime(self.interactions['timestamp'])
-            else:
-                 self.interactions = pd.DataFrame(columns=['user_id', 'product_id', 'action', 'timestamp'])
+            # Under the write lock, so only the first worker to start imports the CSVs, and the
+            # tables are read at exactly the feed position recover() records: a commit another
+            # worker slips in after it is then caught up on top of the loaded tables, not the empty ones
+            with self.store.lock:
+                self.store.recover()
+                if self.storage == 'sqlite' and not self.store.has_tables():
+                    migrate_csv(self.data_dir, self.store, self.STORED_TABLES)
+                    self.store.recover()
+                self._load_tables()
 
-            # Returns (General reference data)
-            ret_path = os.path.join(self.data_dir, 'returns.csv')
-            if os.path.exists(ret_path):
-                self.returns = pd.read_csv(ret_path).fillna(0)
-            else:
-                self.returns = pd.DataFrame(columns=['product_id', 'return_risk_score'])
-            
-            # Load retailers
-            retailer_path = os.path.join(self.data_dir, 'retailers.csv')
-            if os.path.exists(retailer_path):
-                self.retailers = pd.read_csv(retailer_path).fillna("")
-                if 'status' not in self.retailers.columns:
-                    self.retailers['status'] = 'Approved'
-            else:
-                self.retailers = pd.DataFrame(columns=['retailer_id', 'name', 'location', 'delivery_charge', 'rating', 'status'])
-            
-            # Load orders
-            orders_path = os.path.join(self.data_dir, 'orders.csv')
-            if os.path.exists(orders_path):
-                self.orders = pd.read_csv(orders_path).fillna(0)
-            else:
-                self.orders = pd.DataFrame(columns=['order_id', 'user_id', 'retailer_id', 'items_json', 'total_amount', 'status', 'timestamp'])
-            
-            # Load survey
-            survey_path = os.path.join(self.data_dir, 'survey_responses.csv')
-            if os.path.exists(survey_path) and os.path.getsize(survey_path) > 0:
-                self.survey_responses = pd.read_csv(survey_path).fillna("")
-            else:
-                self.survey_responses = pd.DataFrame(columns=['user_id', 'preferred_categories', 'shopping_intent', 'return_sensitivity'])
-            
-            # Load Support Tickets
-            sup_path = os.path.join(self.data_dir, 'support_tickets.csv')
-            if os.path.exists(sup_path):
-                self.support_tickets = pd.read_csv(sup_path).fillna("")
-            else:
-                self.support_tickets = pd.DataFrame(columns=['ticket_id', 'user_id', 'role', 'issue', 'status', 'response', 'timestamp'])
-            
-            # Load Shelf Layout from JSON
-            shelf_path = os.path.join(self.data_dir, 'shelf_layout.json')
-            if os.path.exists(shelf_path):
-                with open(shelf_path, 'r') as f:
-                    self.shelf_layout = json.load(f)
-            
-            if self.use_firestore:
+            if self.compact_interval:
+                self.store.start_compactor(self._table_frame, self.compact_interval)
+            if self.storage == 'sqlite' and self.change_feed_interval:
+                self.start_change_feed(self.change_feed_interval)
+            self.rec_cache.clear()
+
+            if self.use_firestore and self.background_sync:
+                self.start_firestore_sync()
+            elif self.use_firestore:
                 self.sync_to_firestore()
 
+        except StoreLockedError:
+            raise
         except Exception as e:
             print(f"Error loading data: {e}")
 
-    def sync_to_firestore(self):
-        """Initial sync of local CSV data to Firestore."""
-        if not self.fs or not self.fs.db: return
+    @writes
+    def _load_tables(self):
+        """Reads every table and rebuilds the indexes and derived stores, published as one snapshot."""
+        # Users
+        users = self.store.read('users')
+        if users is not None:
+            self.users = users.fillna("")
+            if 'password' not in self.users.columns:
+                self.users['password'] = 'pass123' 
+        else:
+            self.users = pd.DataFrame(columns=['user_id', 'name', 'password', 'active', 'join_date'])
+
+        # Products
+        products = self.store.read('products')
+        if products is not None:
+            self.products = products.fillna(0)
+            if 'active' not in self.products.columns:
+                self.products['active'] = True
+        else:
+            self.products = pd.DataFrame(columns=['product_id', 'retailer_id', 'name', 'category', 'price', 'stock_count', 'discount_pct', 'active'])
         
-        print("Syncing data to Firestore...")
-        # ... (implementation remains the same but with safer check)
+        # Interactions
+        interactions = self.store.read('interactions')
+        if interactions is not None:
+             self.interactions = interactions.fillna("")
+        else:
+             self.interactions = pd.DataFrame(columns=['user_id', 'product_id', 'action', 'timestamp'])
+
+        # Returns (General reference data)
+        returns = self.store.read('returns')
+        if returns is not None:
+            self.returns = returns.fillna(0)
+        else:
+            self.returns = pd.DataFrame(columns=['product_id', 'return_risk_score'])
         
-        # Sync Users
-        for _, u in self.users.iterrows():
-            self.fs.sync_user(str(u['user_id']), u.to_dict())
-            
-        # Sync Retailers
-        for _, r in self.retailers.iterrows():
-            self.fs.add_document("retailers", {
-                "storeName": r['name'],
-                "location": r['location'],
-                "approvedStatus": r['status'],
-                "createdAt": datetime.now()
-            }, doc_id=str(r['retailer_id']))
-            
-        # Sync Products
-        for _, p in self.products.iterrows():
-            self.fs.sync_product(str(p['product_id']), p.to_dict())
-            
-        # Sync Orders
-        for _, o in self.orders.iterrows():
-            self.fs.add_document("orders", {
-                "userId": o['user_id'],
-                "retailerId": o['retailer_id'],
-                "totalAmount": o['total_amount'],
-                "orderDate": o['timestamp'],
-                "status": o['status']
-            }, doc_id=str(o['order_id']))
-
-        print("Firestore sync complete.")
+        # Load retailers
+        retailers = self.store.read('retailers')
+        if retailers is not None:
+            self.retailers = retailers.fillna("")
+            if 'status' not in self.retailers.columns:
+                self.retailers['status'] = 'Approved'
+        else:
+            self.retailers = pd.DataFrame(columns=['retailer_id', 'name', 'location', 'delivery_charge', 'rating', 'status'])
+        
+        # Load orders
+        orders = self.store.read('orders')
+        if orders is not None:
+            self.orders = orders.fillna(0)
+        else:
+            self.orders = pd.DataFrame(columns=['order_id', 'user_id', 'retailer_id', 'items_json', 'total_amount', 'status', 'timestamp'])
+        
+        # Load survey
+        survey_responses = self.store.read('survey_responses')
+        if survey_responses is not None:
+            self.survey_responses = survey_responses.fillna("")
+        else:
+            self.survey_responses = pd.DataFrame(columns=['user_id', 'preferred_categories', 'shopping_intent', 'return_sensitivity'])
+        
+        # Load Support Tickets
+        support_tickets = self.store.read('support_tickets')
+        if support_tickets is not None:
+            self.support_tickets = support_tickets.fillna("")
+        else:
+            self.support_tickets = pd.DataFrame(columns=['ticket_id', 'user_id', 'role', 'issue', 'status', 'response', 'timestamp'])
+        
+        # Load Return Requests
+        return_requests = self.store.read('return_requests')
+        if return_requests is not None:
+            self.return_requests = return_requests.fillna(0)
+        else:
+            self.return_requests = pd.DataFrame(columns=['request_id', 'user_id', 'order_id', 'product_id', 'retailer_id', 'reason', 'condition', 'image_path', 'status', 'admin_notes', 'timestamp', 'fraud_score'])
+        
+        # Load Shelf Layout from JSON
+        shelf_path = os.path.join(self.data_dir, 'shelf_layout.json')
+        if os.path.exists(shelf_path):
+            with open(shelf_path, 'r') as f:
+                self.shelf_layout = json.load(f)
+        
+        # Replay writes acknowledged after the last snapshot (a no-op on SQLite)
+        for table in self.TABLE_KEYS:
+            setattr(self, table, self.store.replay(table, getattr(self, table)))
+        self.interactions = self.interactions.assign(
+            timestamp=pd.to_datetime(self.interactions['timestamp'], format='ISO8601'))
+        for table in self.TABLE_KEYS:
+            self._reindex(table)
+
+        # Fresh stores, swapped in with the snapshot: readers may still be using the current ones
+        self.refresh_affinity()
+        popularity = PopularityIndex(self.popularity.half_life_days)
+        popularity.build(self.interactions, self.products)
+        velocity = SalesVelocity()
+        velocity.build(self._explode_order_items(self.orders), self.orders)
+        trust = TrustScores()
+        trust.build(self.orders, self.return_requests)
+        self.popularity, self.velocity, self.trust = popularity, velocity, trust
+
+    def _explode_order_items(self, orders):
+        """Parses the orders' items_json into one typed row per purchased product."""
+        rows = []
+        if not orders.empty:
+            for order_id, retailer_id, js_str in zip(orders['order_id'], orders['retailer_id'], orders['items_json']):
+                if not isinstance(js_str, str): continue
+                try:
+                    # Handle single quotes in JSON mock data
+                    items = json.loads(js_str.replace("'", '"'))
+                    for pid, details in items.items():
+                        q = details['qty'] if isinstance(details, dict) else details
+                        price = details.get('price') if isinstance(details, dict) else None
+                        rows.append({'order_id': order_id, 'retailer_id': retailer_id, 'product_id': str(pid),
+                                     'qty': int(q), 'unit_price': price})
+                except:
+                    continue
+        items = pd.DataFrame(rows, columns=self.ORDER_ITEM_COLUMNS)
+        items['qty'] = items['qty'].astype('int64')
+        items['unit_price'] = pd.to_numeric(items['unit_price'], errors='coerce')
+        return items
+
+    @staticmethod
+    def _new_id(prefix, now):
+        """Timestamped row id with a random suffix, so ids minted in the same second stay unique."""
+        return f"{prefix}{now.strftime('%Y%m%d%H%M%S')}{uuid.uuid4().hex[:6].upper()}"
+
+    def _sold_quantities(self, retailer_id, window_days=None):
+        """Units sold per product id (as str) for a retailer, optionally over the trailing window_days."""
+        sold = self.velocity.window(retailer_id, window_days) if window_days else self.velocity.totals(retailer_id)
+        return pd.Series(sold, dtype='int64')
+
+    @property
+    def pk(self):
+        return self._view().pk
+
+    @property
+    def fk(self):
+        return self._view().fk
+
+    def _view(self):
+        """The snapshot pinned by the running reader or writer, else the latest published one."""
+        return getattr(self._local, 'snapshot', None) or self._snapshot
+
+    def _publish(self, work):
+        """Makes a writer's snapshot current, then invalidates the cached results it made stale."""
+        self._snapshot = work
+        for table, key in work.bumps:
+            self.rec_cache.bump(table, key)
+
+    def _bump(self, table, key=None):
+        """Invalidates cached results; inside a writer, only once its snapshot is published."""
+        work = getattr(self._local, 'working', None)
+        if work is None: self.rec_cache.bump(table, key)
+        else: work.bumps.append((table, key))
+
+    @writes
+    def _replace_derived(self, name, store):
+        work = self._local.working
+        work.derived[name] = store
+        work.owned_derived.add(name)
+
+    def _own_derived(self, name):
+        """The writer's private copy of a derived store, made on its first in-place change."""
+        work = self._local.working
+        if name not in work.owned_derived:
+            work.derived[name] = work.derived[name].copy()
+            work.owned_derived.add(name)
+        return work.derived[name]
+
+    @writes
+    def _replace_table(self, table, frame):
+        work = self._local.working
+        work.tables[table] = frame
+        work.patches[table] = {}
+        work.owned_patches.add(table)
+
+    def _frame(self, table, view=None):
+        """A whole table with its row patches applied.
+
+        A writer merges its patches into its own copy of the frame; a published
+        snapshot merges them once and shares the result with every reader.
+        """
+        view = view or self._view()
+        patches = view.patches.get(table)
+        if not patches: return view.tables[table]
+        if view is getattr(self._local, 'working', None):
+            self._merge_patches(table)
+            return view.tables[table]
+        merged = view.merged.get(table)
+        if merged is None:
+            merged = view.merged[table] = self._apply_patches(view.tables[table], patches)
+        return merged
+
+    def _base(self, table):
+        """A table without its row patches: enough for the row count, the columns and the primary keys."""
+        return self._view().tables[table]
+
+    @staticmethod
+    def _apply_patches(frame, patches):
+        frame = frame.copy()
+        for idx, values in patches.items():
+            for col, val in values.items():
+                frame.at[idx, col] = val
+        return frame
+
+    def _patched(self, view, table, rows):
+        """Applies the row patches of a table to rows sliced from its base frame."""
+        patches = view.patches.get(table)
+        if not patches: return rows
+        touched = [idx for idx in rows.index if idx in patches]
+        if not touched: return rows
+        rows = rows.copy()
+        for idx in touched:
+            for col, val in patches[idx].items():
+                rows.at[idx, col] = val
+        return rows
+
+    def _own_patches(self, table):
+        """The writer's private copy of a table's row patches."""
+        work = self._local.working
+        if table not in work.owned_patches:
+            work.patches[table] = dict(work.patches.get(table, {}))
+            work.owned_patches.add(table)
+        return work.patches[table]
+
+    def _merge_patches(self, table):
+        """Merges the writer's row patches of a table into its own copy of the frame."""
+        work = self._local.working
+        work.tables[table] = self._apply_patches(work.tables[table], work.patches[table])
+        work.patches[table] = {}
+        work.owned_patches.add(table)
+
+    def _own_index(self, table):
+        """Gives the writer private copies of a table's indexes before it changes them."""
+        work = self._local.working
+        if table in work.owned_indexes: return
+        if table in work.pk: work.pk[table] = work.pk[table].copy()
+        if table in work.fk: work.fk[table] = {col: index.copy() for col, index in work.fk[table].items()}
+        work.owned_indexes.add(table)
+
+    def _table_frame(self, table):
+        # Compaction runs under the store lock, so the published snapshot matches the log watermark
+        return self._frame(table, self._snapshot)
+
+    def _reindex(self, table):
+        """Rebuilds the indexes of a table after its row positions changed."""
+        work = self._local.working
+        frame = getattr(self, table)
+        if table in work.pk:
+            work.pk[table] = PrimaryKeyIndex(self.TABLE_KEYS[table])
+            work.pk[table].build(frame)
+        if table in work.fk:
+            work.fk[table] = {col: GroupIndex(col) for col in self.GROUP_KEYS[table]}
+            for index in work.fk[table].values():
+                index.build(frame)
+        work.owned_indexes.add(table)
+
+    def _row_index(self, table, key):
+        """Row label of a primary key via the hash index, or None."""
+        return self.pk[table].get(key)
+
+    def _row(self, table, idx):
+        """One row by label, as a Series."""
+        return self._rows(table, [idx]).iloc[0]
+
+    def _rows(self, table, labels):
+        """Rows by label, without merging the whole table."""
+        view = self._view()
+        return self._patched(view, table, view.tables[table].loc[labels])
+
+    def _value(self, table, idx, col, default=None):
+        """One cell by row label, or default if the table has no such column."""
+        view = self._view()
+        values = view.patches.get(table, {}).get(idx)
+        if values and col in values: return values[col]
+        frame = view.tables[table]
+        return frame.at[idx, col] if col in frame.columns else default
+
+    def _rows_by(self, table, col, key):
+        """Rows of a table whose foreign-key column equals key, via the group index."""
+        view = self._view()
+        frame = view.tables[table]
+        if frame.empty: return frame
+        return self._patched(view, table, frame.iloc[view.fk[table][col].get(key)])
+
+    def _append_frame(self, table, rows):
+        work = self._local.working
+        # Row patches keep their labels, so appending to the base frame leaves them valid
+        frame = work.tables[table]
+        start = len(frame)
+        work.tables[table] = pd.concat([frame, pd.DataFrame(rows)], ignore_index=True)
+        self._own_index(table)
+        if table in self.pk:
+            self.pk[table].add([row.get(self.TABLE_KEYS[table]) for row in rows], start)
+        for col, index in self.fk.get(table, {}).items():
+            index.add([row.get(col) for row in rows], start)
+
+    @writes
+    def _insert_rows(self, table, rows):
+        """Logs rows, then appends them to the in-memory table."""
+        self.store.append(table, 'insert', rows=rows)
+        self._append_frame(table, rows)
+
+    def _set_values(self, table, idx, values):
+        """Sets columns of one row in memory, moving it between groups if a foreign key changed.
+
+        The new values become a row patch over the shared frame rather than a
+        copy of it, so a single-row write costs the same at any table size.
+        """
+        missing = object()
+        moved = {}
+        for col in values:
+            old = self._value(table, idx, col, missing) if col in self.fk.get(table, {}) else missing
+            if old is not missing: moved[col] = old
+        patches = self._own_patches(table)
+        patches[idx] = {**patches.get(idx, {}), **values}
+        if moved:
+            self._own_index(table)
+            for col, old in moved.items():
+                self.fk[table][col].move(idx, old, values[col])
+        if len(patches) > self.MAX_ROW_PATCHES: self._merge_patches(table)
+
+    @writes
+    def _update_row(self, table, idx, values):
+        """Logs a change to columns of one row, then applies it."""
+        key = self._value(table, idx, self.TABLE_KEYS[table])
+        self.store.append(table, 'update', key=key, values=values)
+        self._set_values(table, idx, values)
+
+    @writes
+    def _delete_rows(self, table, key):
+        """Logs the deletion of the rows with the given primary key, then removes them."""
+        self.store.append(table, 'delete', key=key)
+        self._drop_rows(table, key)
+
+    def _drop_rows(self, table, key):
+        frame = getattr(self, table)
+        setattr(self, table, frame[frame[self.TABLE_KEYS[table]] != key].reset_index(drop=True))
+        self._reindex(table)
+
+    @writes
+    def _commit(self, ops):
+        """Logs a multi-table write as one all-or-nothing commit, then applies it in memory.
+
+        ops are dicts with 'table' and 'op': 'insert' with 'rows', or 'update'
+        with the row label 'idx' and 'values'. If logging fails, nothing has
+        changed in memory.
+        """
+        log_ops = []
+        for op in ops:
+            table = op['table']
+            if op['op'] == 'insert':
+                log_ops.append({'table': table, 'op': 'insert', 'rows': op['rows']})
+            elif op['op'] == 'update':
+                key = self._value(table, op['idx'], self.TABLE_KEYS[table])
+                log_ops.append({'table': table, 'op': 'update', 'key': key, 'values': op['values']})
+        self.store.commit(log_ops)
+        for op in ops:
+            if op['op'] == 'insert': self._append_frame(op['table'], op['rows'])
+            elif op['op'] == 'update': self._set_values(op['table'], op['idx'], op['values'])
+
+    def _apply_changes(self):
+        """Applies the writes other worker processes committed to the working snapshot.
+
+        Each operation updates the derived stores the way the writer that made
+        it did, so catching up costs the size of the change, not of the tables.
+        """
+        ops = self.store.changes()
+        if ops is None:
+            # The change feed no longer reaches back far enough
+            self._load_tables()
+            return
+        for op in ops:
+            table = op['table']
+            if op['op'] == 'insert':
+                rows = op['rows']
+                if table == 'interactions':
+                    # The feed carries timestamps as ISO strings; the frame holds datetimes
+                    rows = [dict(row, timestamp=pd.Timestamp(row['timestamp'])) for row in rows]
+                self._append_frame(table, rows)
+                self._count_inserted(table, rows)
+            elif op['op'] == 'update':
+                idx = self._row_index(table, op['key'])
+                if idx is None: continue
+                values = op['values']
+                recategorized = (table == 'products' and 'category' in values
+                                 and values['category'] != self._value('products', idx, 'category'))
+                self._set_values(table, idx, values)
+                if recategorized: self._refresh_categories()
+                if table == 'survey_responses' and 'preferred_categories' in values:
+                    self._own_derived('affinity').set_survey(op['key'], values['preferred_categories'])
+            elif op['op'] == 'delete':
+                if table in ('orders', 'return_requests', 'interactions'):
+                    # Counts cannot be taken back one row at a time; no writer deletes these
+                    self._load_tables()
+                    return
+                self._drop_rows(table, op['key'])
+                # Interactions with a deleted product no longer count towards affinity
+                if table == 'products': self._refresh_categories()
+            if table == 'survey_responses':
+                user_ids = [row['user_id'] for row in op['rows']] if op['op'] == 'insert' else [op['key']]
+                for user_id in user_ids: self._bump('surveys', user_id)
+            if table in ('products', 'interactions'): self._bump(table)
+
+    def _count_inserted(self, table, rows):
+        """Adds rows another worker inserted to the derived stores, as place_order and friends do."""
+        if table == 'orders':
+            items = self._explode_order_items(pd.DataFrame(rows))
+            order_times = {row['order_id']: row.get('timestamp') for row in rows}
+            for order_id, retailer_id, pid, qty in zip(items['order_id'], items['retailer_id'], items['product_id'], items['qty']):
+                self._own_derived('velocity').record(retailer_id, pid, qty, order_times[order_id])
+            for row in rows: self._own_derived('trust').add_order(row['user_id'])
+        elif table == 'return_requests':
+            for row in rows: self._own_derived('trust').add_return(row['user_id'])
+        elif table == 'interactions':
+            for row in rows:
+                idx = self._row_index('products', row['product_id'])
+                category = None if idx is None else self._value('products', idx, 'category')
+                retailer_id = None if idx is None else self._value('products', idx, 'retailer_id')
+                self._own_derived('affinity').add_interaction(row['user_id'], category, row['action'])
+                self._own_derived('popularity').record(row['product_id'], retailer_id, category, row['action'], row['timestamp'])
+        elif table == 'survey_responses':
+            for row in rows: self._own_derived('affinity').set_survey(row['user_id'], row.get('preferred_categories'))
+
+    @writes
+    def catch_up(self):
+        """Publishes the commits of other worker processes now; every writer does so on entry."""
+
+    def start_change_feed(self, interval_seconds=1.0):
+        """Polls storage for commits by other worker processes and publishes them in the background."""
+        def run():
+            while not self._stop_changes.wait(interval_seconds):
+                try:
+                    if self.store.has_changes(): self.catch_up()
+                except Exception as e:
+                    print(f"Change feed failed: {e}")
+
+        self._change_thread = threading.Thread(target=run, name='change-feed', daemon=True)
+        self._change_thread.start()
+
+    def close(self):
+        """Stops background compaction, writes final snapshots and flushes carts and queued Firestore writes."""
+        self._stop_changes.set()
+        if self._change_thread is not None: self._change_thread.join(timeout=30)
+        self.store.close(self._table_frame)
+        if self._sync_thread is not None: self._sync_thread.join(timeout=30)
+        self.carts.close()
+        if self.fs: self.fs.close()
+
+    def _sync_state_path(self):
+        return os.path.join(self.data_dir, 'firestore_sync_state.json')
+
+    def _load_sync_state(self):
+        path = self._sync_state_path()
+        if not os.path.exists(path): return {}
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}  # unreadable state only costs a full resync
+
+    def _save_sync_state(self, state):
+        path = self._sync_state_path()
+        # Per-process temp file: with several workers each one may save the state
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _row_hash(row):
+        return hashlib.sha1(json.dumps(row, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _firestore_doc(self, table, row, now):
+        if table == 'users': return self.fs.user_doc(row)
+        if table == 'products': return self.fs.product_doc(row)
+        if table == 'retailers':
+            return {
+                "storeName": row['name'],
+                "location": row['location'],
+                "approvedStatus": row['status'],
+                "createdAt": now
+            }
+        return {
+            "userId": row['user_id'],
+            "retailerId": row['retailer_id'],
+            "totalAmount": row['total_amount'],
+            "orderDate": row['timestamp'],
+            "status": row['status']
+        }
+
+    def start_firestore_sync(self):
+        """Runs sync_to_firestore in a background thread so startup does not wait on Firestore."""
+        def run():
+            try:
+                self.sync_to_firestore()
+            except Exception as e:
+                print(f"Firestore sync failed: {e}")
+
+        self._sync_thread = threading.Thread(target=run, name='firestore-sync', daemon=True)
+        self._sync_thread.start()
+
+    @reads
+    def sync_to_firestore(self, full=False):
+        """Mirrors rows added, changed or deleted since the last successful sync to Firestore.
+
+        A content hash per mirrored row is kept in firestore_sync_state.json
+        next to the CSVs; full=True ignores it and pushes every row.
+        """
+        if not self.fs or not self.fs.db: return
+        
+        # The in-memory backend starts empty and must not touch the real backend's sync state
+        track_state = self.fs.persistent
+        state = self._load_sync_state() if track_state and not full else {}
+        tables = {table: getattr(self, table).to_dict(orient='records') for table in self.SYNC_TABLES}
+
+        now = datetime.now()
+        writes, new_state = [], {}
+        for table, rows in tables.items():
+            key_col = self.TABLE_KEYS[table]
+            synced = state.get(table, {})
+            hashes = new_state[table] = {}
+            for row in rows:
+                doc_id = str(row[key_col])
+                hashes[doc_id] = self._row_hash(row)
+                if synced.get(doc_id) != hashes[doc_id]:
+                    writes.append(('set', table, doc_id, self._firestore_doc(table, row, now)))
+            writes.extend(('delete', table, doc_id, None) for doc_id in synced if doc_id not in hashes)
+
+        if not writes:
+            print("Firestore already in sync.")
+            return
+        print(f"Syncing {len(writes)} changed documents to Firestore...")
+        # One round trip per MAX_BATCH_WRITES documents instead of one per row
+        if self.fs.commit_batch_and_wait(writes):
+            if track_state: self._save_sync_state(new_state)
+            print("Firestore sync complete.")
+        else:
+            print("Firestore sync incomplete; unsynced rows will be retried on next start.")
 
     def update_cart(self, user_id, store_id, items_dict):
-        """Update user's cart in Firestore."""
-        if not self.fs: return False
-        cart_id = f"CART_{user_id}_{store_id}"
-        self.fs.add_document("carts", {
-            "userId": user_id,
-            "storeId": store_id,
-            "items": [{"productId": pid, "quantity": qty} for pid, qty in items_dict.items()],
-            "updatedAt": datetime.now()
-        }, doc_id=cart_id)
+        """Replace user's cart; persisted to Firestore after edits settle."""
+        self.carts.replace(user_id, store_id, items_dict)
         return True
 
     def get_cart(self, user_id, store_id):
-        """Fetch user's cart from Firestore."""
-        if not self.fs: return None
-        cart_id = f"CART_{user_id}_{store_id}"
-        return self.fs.get_document("carts", cart_id)
+        """Fetch user's cart, from memory when it is active."""
+        return self.carts.get(user_id, store_id)
+
+    def add_to_cart(self, user_id, store_id, product_id, quantity=1):
+        return self.carts.add_item(user_id, store_id, product_id, quantity)
+
+    def set_cart_quantity(self, user_id, store_id, product_id, quantity):
+        return self.carts.set_quantity(user_id, store_id, product_id, quantity)
+
+    def remove_from_cart(self, user_id, store_id, product_id):
+        return self.carts.remove_item(user_id, store_id, product_id)
 
     def save_survey_response(self, user_id, preferences, intent, return_sensitivity, age, gender, dietary):
         new_row = {
@@ -169,21 +727,23 @@ class RecommendationEngine:
             'dietary_preferences': '|'.join(dietary)
         }
         
-        if self.survey_responses.empty:
-             self.survey_responses = pd.DataFrame(columns=new_row.keys())
+        # Firestore is written after the writer releases the lock, so other writers never wait on it
+        with writing(self):
+            if self._base('survey_responses').empty:
+                 self.survey_responses = pd.DataFrame(columns=new_row.keys())
 
-        # Ensure columns exist if loading old CSV
-        for col in new_row.keys():
-            if col not in self.survey_responses.columns:
-                self.survey_responses[col] = None
-                
-        if user_id in self.survey_responses['user_id'].values:
-            idx = self.survey_responses[self.survey_responses['user_id'] == user_id].index[0]
-            for key, val in new_row.items():
-                self.survey_responses.at[idx, key] = val
-        else:
-            self.survey_responses = pd.concat([self.survey_responses, pd.DataFrame([new_row])], ignore_index=True)
-        self.survey_responses.to_csv(os.path.join(self.data_dir, 'survey_responses.csv'), index=False)
+            # Ensure columns exist if loading old CSV
+            if any(col not in self._base('survey_responses').columns for col in new_row):
+                missing = {col: None for col in new_row if col not in self.survey_responses.columns}
+                if missing: self.survey_responses = self.survey_responses.assign(**missing)
+                    
+            idx = self._row_index('survey_responses', user_id)
+            if idx is not None:
+                self._update_row('survey_responses', idx, new_row)
+            else:
+                self._insert_rows('survey_responses', [new_row])
+            self._own_derived('affinity').set_survey(user_id, preferences)
+            self._bump('surveys', user_id)
         
         if self.use_firestore:
             self.fs.add_document("survey_responses", {
@@ -197,19 +757,19 @@ class RecommendationEngine:
 
     def register_user(self, name, user_id, password, role="customer"):
         """Registers a new user or retailer."""
-        if user_id in self.users['user_id'].values:
-            return {"status": "error", "message": "Identity already taken"}
+        with writing(self):
+            if user_id in self.pk['users']:
+                return {"status": "error", "message": "Identity already taken"}
+                
+            new_user = {
+                'user_id': user_id,
+                'name': name,
+                'password': str(password),
+                'active': True,
+                'join_date': datetime.now().strftime('%Y-%m-%d')
+            }
             
-        new_user = {
-            'user_id': user_id,
-            'name': name,
-            'password': str(password),
-            'active': True,
-            'join_date': datetime.now().strftime('%Y-%m-%d')
-        }
-        
-        self.users = pd.concat([self.users, pd.DataFrame([new_user])], ignore_index=True)
-        self.users.to_csv(os.path.join(self.data_dir, 'users.csv'), index=False)
+            self._insert_rows('users', [new_user])
         
         if self.use_firestore:
             self.fs.sync_user(user_id, new_user)
@@ -219,25 +779,23 @@ class RecommendationEngine:
 
     def create_user(self, name):
         """Legacy helper for internal tests."""
-        num = len(self.users) + 100
+        num = len(self._base('users')) + 100
         user_id = f"U{num:03d}"
         return self.register_user(name, user_id, "pass123")["user_id"]
 
 
+    @writes
     def delete_retailer(self, retailer_id):
-        self.retailers = self.retailers[self.retailers['retailer_id'] != retailer_id]
-        self.retailers.to_csv(os.path.join(self.data_dir, 'retailers.csv'), index=False)
+        self._delete_rows('retailers', retailer_id)
         return True
 
+    @reads
     def get_platform_stats(self):
         # Default stats from CSV
-        returns_count = 0
+        returns_count = len(self.return_requests)
         fraud_alerts = 0
-        req_path = os.path.join(self.data_dir, 'return_requests.csv')
-        if os.path.exists(req_path):
-            df_ret = pd.read_csv(req_path).fillna(0)
-            returns_count = len(df_ret)
-            fraud_alerts = len(df_ret[df_ret['fraud_score'] > 60])
+        if returns_count:
+            fraud_alerts = int((pd.to_numeric(self.return_requests['fraud_score'], errors='coerce') > 60).sum())
 
         total_vol = float(self.orders['total_amount'].sum()) if not self.orders.empty else 0
         
@@ -262,42 +820,43 @@ class RecommendationEngine:
 
     def get_user_trust_score(self, user_id):
         """Calculates a trust score based on return history."""
-        user_orders = self.orders[self.orders['user_id'] == user_id]
-        if user_orders.empty: return 100 
-        
-        total_orders = len(user_orders)
-        
-        req_path = os.path.join(self.data_dir, 'return_requests.csv')
-        if not os.path.exists(req_path): return 100
-        
-        all_reqs = pd.read_csv(req_path).fillna(0)
-        user_returns = all_reqs[all_reqs['user_id'] == user_id]
-        total_returns = len(user_returns)
-        
-        if total_orders == 0: return 100
-        return_rate = total_returns / total_orders
-        
-        score = max(0, 100 - int(return_rate * 100))
-        return score
+        return self.trust.score(user_id)
 
+    def get_trust_scores(self, user_ids=None, lowest_n=None):
+        """Trust scores for a list of users, or for the lowest_n least trusted users."""
+        if lowest_n is not None:
+            pairs = self.trust.lowest(lowest_n)
+        else:
+            pairs = self.trust.scores(user_ids or []).items()
+        return [{"user_id": uid, "score": score} for uid, score in pairs]
+
+    @reads
     def get_retailers(self):
         return self.retailers.fillna("").to_dict(orient='records')
 
+    @reads
+    def get_product(self, product_id):
+        """Product row by id via the primary-key index, or None."""
+        idx = self._row_index('products', product_id)
+        return None if idx is None else self._row('products', idx)
+
     def get_retailer_products(self, retailer_id):
-        return self.products[self.products['retailer_id'] == retailer_id].copy()
+        return self._rows_by('products', 'retailer_id', retailer_id).copy()
 
     def update_product_stock_price(self, product_id, new_stock=None, new_price=None, new_discount=None, active=None):
         """Update product details and save to CSV."""
-        idx = self.products.index[self.products['product_id'] == product_id].tolist()
-        if not idx: return False
-        
-        idx = idx[0]
-        if new_stock is not None: self.products.at[idx, 'stock_count'] = int(new_stock)
-        if new_price is not None: self.products.at[idx, 'price'] = int(new_price)
-        if new_discount is not None: self.products.at[idx, 'discount_pct'] = int(new_discount)
-        if active is not None: self.products.at[idx, 'active'] = bool(active)
-        
-        self.products.to_csv(os.path.join(self.data_dir, 'products.csv'), index=False)
+        with writing(self):
+            idx = self._row_index('products', product_id)
+            if idx is None: return False
+            
+            values = {}
+            if new_stock is not None: values['stock_count'] = int(new_stock)
+            if new_price is not None: values['price'] = int(new_price)
+            if new_discount is not None: values['discount_pct'] = int(new_discount)
+            if active is not None: values['active'] = bool(active)
+            
+            if values: self._update_row('products', idx, values)
+            self._bump('products')
         
         if self.use_firestore:
             update_data = {}
@@ -308,31 +867,34 @@ class RecommendationEngine:
         return True
 
     def add_product(self, retailer_id, name, category, price, stock, discount=0, combo_offer="", imageUrl=""):
-        if not self.products.empty:
-            try:
-                last_id = self.products['product_id'].max()
-                num = int(last_id[1:]) + 1
-            except:
-                num = len(self.products) + 1000
-        else:
-            num = 1
-            
-        pid = f"P{num:04d}"
-        new_prod = {
-            'product_id': pid,
-            'retailer_id': retailer_id,
-            'name': name,
-            'category': category,
-            'price': price,
-            'stock_count': stock,
-            'discount_pct': discount,
-            'combo_offer': combo_offer,
-            'imageUrl': imageUrl,
-            'is_essential': False,
-            'active': True
-        }
-        self.products = pd.concat([self.products, pd.DataFrame([new_prod])], ignore_index=True)
-        self.products.to_csv(os.path.join(self.data_dir, 'products.csv'), index=False)
+        with writing(self):
+            # Ids are never updated, so the unmerged frame has them all
+            products = self._base('products')
+            if not products.empty:
+                try:
+                    last_id = products['product_id'].max()
+                    num = int(last_id[1:]) + 1
+                except:
+                    num = len(products) + 1000
+            else:
+                num = 1
+                
+            pid = f"P{num:04d}"
+            new_prod = {
+                'product_id': pid,
+                'retailer_id': retailer_id,
+                'name': name,
+                'category': category,
+                'price': price,
+                'stock_count': stock,
+                'discount_pct': discount,
+                'combo_offer': combo_offer,
+                'imageUrl': imageUrl,
+                'is_essential': False,
+                'active': True
+            }
+            self._insert_rows('products', [new_prod])
+            self._bump('products')
         
         if self.use_firestore:
             self.fs.sync_product(pid, new_prod)
@@ -340,152 +902,160 @@ class RecommendationEngine:
         return pid
 
     def delete_product(self, product_id):
-        if product_id in self.products['product_id'].values:
-            self.products = self.products[self.products['product_id'] != product_id]
-            self.products.to_csv(os.path.join(self.data_dir, 'products.csv'), index=False)
-            
-            if self.use_firestore and self.fs:
-                self.fs.delete_document("products", product_id)
+        with writing(self):
+            if product_id not in self.pk['products']: return False
+            self._delete_rows('products', product_id)
+            # Interactions with a deleted product no longer count towards affinity
+            self._refresh_categories()
+            self._bump('products')
             
-            return True
-        return False
+        if self.use_firestore and self.fs:
+            self.fs.delete_document("products", product_id)
+        
+        return True
+
+    @writes
+    def update_product_fields(self, product_id, **fields):
+        """Updates descriptive product columns such as name, category, combo_offer or imageUrl."""
+        idx = self._row_index('products', product_id)
+        if idx is None: return False
+
+        category_changed = 'category' in fields and fields['category'] != self._value('products', idx, 'category')
+        if fields: self._update_row('products', idx, fields)
+        if category_changed:
+            self._refresh_categories()
+        self._bump('products')
+        return True
 
     def place_order(self, user_id, retailer_id, items_dict):
         if not items_dict: return None
         
-        total_amt = 0
-        valid_items = {}
-        fs_items = []
-        for pid, qty in items_dict.items():
-            prod = self.products[self.products['product_id'] == pid]
-            if not prod.empty:
-                price = prod.iloc[0]['price']
-                discount = prod.iloc[0]['discount_pct']
-                final_price = price * (1 - discount/100)
-                total_amt += final_price * qty
-                valid_items[pid] = {'qty': qty, 'price': final_price, 'name': prod.iloc[0]['name']}
-                fs_items.append({"productId": pid, "quantity": qty, "priceAtPurchase": final_price})
-                
-                current_stock = prod.iloc[0]['stock_count']
-                self.update_product_stock_price(pid, new_stock=max(0, current_stock - qty))
+        # Stock is read and decremented by one writer, so concurrent orders cannot oversell
+        with writing(self):
+            # Price the whole cart in one pass over the cart's catalog rows only
+            found = {pid: qty for pid, qty in items_dict.items() if pid in self.pk['products']}
+            rows = [self._row_index('products', pid) for pid in found]
+            cols = ['retailer_id', 'name', 'category', 'price', 'discount_pct', 'stock_count']
+            lines = self._rows('products', rows)[cols].reset_index(drop=True)
+            lines.insert(0, 'idx', rows)
+            lines.insert(0, 'qty', list(found.values()))
+            lines.insert(0, 'product_id', list(found))
+            lines['final_price'] = lines['price'] * (1 - lines['discount_pct'] / 100)
+            lines['new_stock'] = (lines['stock_count'] - lines['qty']).clip(lower=0)
+            total_amt = float((lines['final_price'] * lines['qty']).sum())
         
-        order_id = f"ORD{datetime.now().strftime('%Y%m%d%H%M%S')}"
-        new_order = {
-            'order_id': order_id,
-            'user_id': user_id,
-            'retailer_id': retailer_id,
-            'items_json': json.dumps(valid_items),
-            'total_amount': round(total_amt, 2),
-            'status': 'Placed',
-            'timestamp': datetime.now().isoformat()
-        }
+            now = datetime.now()
+            order_id = self._new_id('ORD', now)
+            valid_items = {
+                pid: {'qty': int(qty), 'price': float(price), 'name': name}
+                for pid, qty, price, name in zip(lines['product_id'], lines['qty'], lines['final_price'], lines['name'])
+            }
+            new_order = {
+                'order_id': order_id,
+                'user_id': user_id,
+                'retailer_id': retailer_id,
+                'items_json': json.dumps(valid_items),
+                'total_amount': round(total_amt, 2),
+                'status': 'Placed',
+                'timestamp': now.isoformat()
+            }
+            new_interactions = [
+                {'user_id': user_id, 'product_id': pid, 'action': 'purchase', 'timestamp': now}
+                for pid in valid_items
+            ]
         
-        self.orders = pd.concat([self.orders, pd.DataFrame([new_order])], ignore_index=True)
-        self.orders.to_csv(os.path.join(self.data_dir, 'orders.csv'), index=False)
+            # Stock decrements, the order row and the interaction rows land as one commit
+            ops = [
+                {'table': 'products', 'op': 'update', 'idx': idx, 'values': {'stock_count': int(stock)}}
+                for idx, stock in zip(lines['idx'], lines['new_stock'])
+            ]
+            ops.append({'table': 'orders', 'op': 'insert', 'rows': [new_order]})
+            if new_interactions:
+                ops.append({'table': 'interactions', 'op': 'insert', 'rows': new_interactions})
+            self._commit(ops)
+            for pid, item in valid_items.items():
+                self._own_derived('velocity').record(retailer_id, pid, item['qty'], now)
+            self._own_derived('trust').add_order(user_id)
+        
+            for pid, category, product_retailer in zip(lines['product_id'], lines['category'], lines['retailer_id']):
+                self._own_derived('affinity').add_interaction(user_id, category, 'purchase')
+                self._own_derived('popularity').record(pid, product_retailer, category, 'purchase', now)
+            self._bump('products')
+            self._bump('interactions')
         
         if self.use_firestore:
-            self.fs.add_document("orders", {
+            writes = [
+                ('update', 'products', pid, {"stockQuantity": int(stock)})
+                for pid, stock in zip(lines['product_id'], lines['new_stock'])
+            ]
+            writes.append(('set', 'orders', order_id, {
                 "userId": user_id,
                 "retailerId": retailer_id,
-                "products": fs_items,
+                "products": [
+                    {"productId": pid, "quantity": item['qty'], "priceAtPurchase": item['price']}
+                    for pid, item in valid_items.items()
+                ],
                 "totalAmount": round(total_amt, 2),
-                "orderDate": datetime.now(),
+                "orderDate": now,
                 "orderType": "online",
                 "status": "Placed"
-            }, doc_id=order_id)
+            }))
+            writes.extend(('add', 'interactions', None, {
+                "userId": user_id,
+                "productId": pid,
+                "action": "purchase",
+                "timestamp": now
+            }) for pid in valid_items)
+            self.fs.commit_batch(writes)
             self.fs.log_activity(user_id, "user", f"order_placed_{order_id}")
-
-        new_interactions = []
-        for pid in valid_items:
-            new_interactions.append({
-                'user_id': user_id,
-                'product_id': pid,
-                'action': 'purchase',
-                'timestamp': datetime.now()
-            })
-            if self.use_firestore:
-                self.fs.add_document("interactions", {
-                    "userId": user_id,
-                    "productId": pid,
-                    "action": "purchase",
-                    "timestamp": datetime.now()
-                })
-        
-        if new_interactions:
-            self.interactions = pd.concat([self.interactions, pd.DataFrame(new_interactions)], ignore_index=True)
-            self.interactions.to_csv(os.path.join(self.data_dir, 'interactions.csv'), index=False)
             
         return order_id
 
+    @reads
     def get_user_orders(self, user_id):
-        user_orders = self.orders[self.orders['user_id'] == user_id].copy()
+        user_orders = self._rows_by('orders', 'user_id', user_id).copy()
         if user_orders.empty: return pd.DataFrame()
         return user_orders.merge(self.retailers[['retailer_id', 'name']], on='retailer_id', how='left')
 
     def get_user_affinity(self, user_id):
-        user_interactions = self.interactions[self.interactions['user_id'] == user_id]
-        behavior_affinity = {cat: 0.0 for cat in self.categories}
-        
-        if not user_interactions.empty:
-            user_activity = user_interactions.merge(self.products[['product_id', 'category']], on='product_id', how='left')
-            points = {'view': 1, 'click': 2, 'purchase': 3}
-            for _, row in user_activity.iterrows():
-                if pd.notna(row['category']) and row['category'] in behavior_affinity:
-                    behavior_affinity[row['category']] += points.get(row['action'], 0)
-            
-            total_points = sum(behavior_affinity.values())
-            if total_points > 0:
-                for cat in behavior_affinity: behavior_affinity[cat] /= total_points
-
-        survey_affinity = {cat: 0.0 for cat in self.categories}
-        if not self.survey_responses.empty:
-             user_survey = self.survey_responses[self.survey_responses['user_id'] == user_id]
-             if not user_survey.empty:
-                prefs = user_survey.iloc[0]['preferred_categories']
-                if isinstance(prefs, str):
-                    selected_cats = prefs.split('|')
-                    for cat in selected_cats:
-                        if cat in survey_affinity: survey_affinity[cat] = 1.0
-                    total_survey = sum(survey_affinity.values())
-                    if total_survey > 0:
-                        for cat in survey_affinity: survey_affinity[cat] /= total_survey
-        
-        final_affinity = {}
-        for cat in self.categories:
-            final_affinity[cat] = 0.7 * behavior_affinity[cat] + 0.3 * survey_affinity[cat]
-        for cat in self.categories:
-            final_affinity[cat] = 0.7 * behavior_affinity[cat] + 0.3 * survey_affinity[cat]
-        return final_affinity
+        return self.affinity.get(user_id)
+
+    @writes
+    def refresh_affinity(self):
+        """Rebuilds the affinity matrix, e.g. after product categories change.
+
+        The matrix is built fresh and swapped in, so readers keep using the
+        current one until the writer publishes.
+        """
+        affinity = AffinityMatrix(self.categories)
+        affinity.build(self.interactions, self.products, self.survey_responses)
+        self.affinity = affinity
+
+    def _refresh_categories(self):
+        """Rebuilds the stores that attribute interactions to product categories and retailers."""
+        self.refresh_affinity()
+        popularity = PopularityIndex(self.popularity.half_life_days)
+        popularity.build(self.interactions, self.products)
+        self.popularity = popularity
 
     # --- Retailer Features ---
 
+    @reads
     def get_retailer_orders(self, retailer_id):
         """Fetch orders specific to a retailer."""
         if self.orders.empty: return []
         
         # Filter orders
-        r_orders = self.orders[self.orders['retailer_id'] == retailer_id].copy()
+        r_orders = self._rows_by('orders', 'retailer_id', retailer_id).copy()
         if r_orders.empty: return []
         
         return r_orders.to_dict(orient='records')
 
-    def get_retailer_analytics(self, retailer_id):
+    @reads
+    def get_retailer_analytics(self, retailer_id, window_days=None):
         """Generate analysis data for charts and inventory tracking."""
-        r_orders = self.orders[self.orders['retailer_id'] == retailer_id]
-        
-        # Calculate sold quantities from orders items_json
-        sold_stats = {}
-        for _, order in r_orders.iterrows():
-            try:
-                # Handle single quotes in JSON mock data if needed
-                js_str = order['items_json']
-                if isinstance(js_str, str):
-                    items = json.loads(js_str.replace("'", '"'))
-                    for pid, details in items.items():
-                        q = details['qty'] if isinstance(details, dict) else details
-                        sold_stats[str(pid)] = sold_stats.get(str(pid), 0) + int(q)
-            except:
-                continue
+        r_orders = self._rows_by('orders', 'retailer_id', retailer_id)
+        sold_stats = self._sold_quantities(retailer_id, window_days)
         
         # Get products with updated stock info
         my_prods_df = self.get_retailer_products(retailer_id)
@@ -494,7 +1064,7 @@ class RecommendationEngine:
             for _, p in my_prods_df.iterrows():
                 pid = str(p['product_id'])
                 p_dict = p.to_dict()
-                p_dict['sold_qty'] = sold_stats.get(pid, 0)
+                p_dict['sold_qty'] = int(sold_stats.get(pid, 0))
                 p_dict['remaining_qty'] = p_dict.get('stock_count', 0)
                 inventory.append(p_dict)
 
@@ -509,26 +1079,18 @@ class RecommendationEngine:
             "sales_trend": sales_data,
             "inventory": inventory,
             "total_revenue": float(r_orders['total_amount'].sum()) if not r_orders.empty else 0,
-            "total_orders": len(r_orders)
+            "total_orders": len(r_orders),
+            "trending_score": round(self.popularity.retailer_score(retailer_id), 2)
         }
 
-    def get_shelf_recommendations(self, retailer_id):
+    @reads
+    def get_shelf_recommendations(self, retailer_id, window_days=None):
         """Generate shelf optimization recommendations based on sales velocity."""
         # 1. Calculate Sales Velocity
-        r_orders = self.orders[self.orders['retailer_id'] == retailer_id]
-        sold_stats = {}
-        for _, order in r_orders.iterrows():
-            try:
-                js_str = order['items_json']
-                if isinstance(js_str, str):
-                    items = json.loads(js_str.replace("'", '"'))
-                    for pid, details in items.items():
-                        q = details['qty'] if isinstance(details, dict) else details
-                        sold_stats[str(pid)] = sold_stats.get(str(pid), 0) + int(q)
-            except: continue
+        sold_stats = self._sold_quantities(retailer_id, window_days)
             
         # 2. Get Products for this retailer
-        my_prods = self.products[self.products['retailer_id'] == retailer_id].copy()
+        my_prods = self.get_retailer_products(retailer_id)
         if my_prods.empty: return []
         
         # Add sold_qty to the products
@@ -578,23 +1140,14 @@ class RecommendationEngine:
         
         return recs
 
-    def get_retailer_shelf(self, retailer_id):
+    @reads
+    def get_retailer_shelf(self, retailer_id, window_days=None):
         """Generates a dynamic shelf layout based on real sales performance metadata."""
         # 1. Calculate Sales
-        r_orders = self.orders[self.orders['retailer_id'] == retailer_id]
-        sold_stats = {}
-        for _, order in r_orders.iterrows():
-            try:
-                js_str = order['items_json']
-                if isinstance(js_str, str):
-                    items = json.loads(js_str.replace("'", '"'))
-                    for pid, details in items.items():
-                        q = details['qty'] if isinstance(details, dict) else details
-                        sold_stats[str(pid)] = sold_stats.get(str(pid), 0) + int(q)
-            except: continue
+        sold_stats = self._sold_quantities(retailer_id, window_days)
             
         # 2. Get Products
-        my_prods = self.products[self.products['retailer_id'] == retailer_id].copy()
+        my_prods = self.get_retailer_products(retailer_id)
         if my_prods.empty:
             # Fallback to some generic data if they have no products yet
             return [
@@ -642,29 +1195,33 @@ class RecommendationEngine:
             }
         ]
 
+    @reads
     def login_user(self, user_id, password):
-        if user_id in self.users['user_id'].values:
-            user = self.users[self.users['user_id'] == user_id].iloc[0]
+        idx = self._row_index('users', user_id)
+        if idx is not None:
+            user = self._row('users', idx)
             if str(user['password']) == str(password):
                 return {"status": "success", "user": user.to_dict()}
             return {"status": "error", "message": "Invalid password"}
         return {"status": "error", "message": "User not found"}
 
     def get_user_recommendations(self, user_id, retailer_id=None):
-        # Already handled by get_recommendations
+        # Already handled (and cached) by get_recommendations
         return self.get_recommendations(user_id, retailer_id)
 
+    @writes
     def ban_user(self, user_id):
-        if user_id in self.users['user_id'].values:
-            self.users.loc[self.users['user_id'] == user_id, 'active'] = False
-            self.users.to_csv(os.path.join(self.data_dir, 'users.csv'), index=False) # Save the change
+        idx = self._row_index('users', user_id)
+        if idx is not None:
+            self._update_row('users', idx, {'active': False})
             return True
         return False
 
     # --- Support System ---
 
+    @writes
     def create_support_ticket(self, user_id, role, issue):
-        tid = f"TKT{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        tid = self._new_id('TKT', datetime.now())
         new_tkt = {
             'ticket_id': tid,
             'user_id': user_id,
@@ -674,82 +1231,180 @@ class RecommendationEngine:
             'response': '',
             'timestamp': datetime.now().isoformat()
         }
-        self.support_tickets = pd.concat([self.support_tickets, pd.DataFrame([new_tkt])], ignore_index=True)
-        self.support_tickets.to_csv(os.path.join(self.data_dir, 'support_tickets.csv'), index=False)
+        self._insert_rows('support_tickets', [new_tkt])
         return tid
 
+    @reads
     def get_support_tickets(self):
         if self.support_tickets.empty: return []
         return self.support_tickets.to_dict(orient='records')
 
+    @writes
     def resolve_ticket(self, ticket_id, response):
-        if ticket_id in self.support_tickets['ticket_id'].values:
-            idx = self.support_tickets[self.support_tickets['ticket_id'] == ticket_id].index[0]
-            self.support_tickets.at[idx, 'status'] = 'Resolved'
-            self.support_tickets.at[idx, 'response'] = response
-            self.support_tickets.to_csv(os.path.join(self.data_dir, 'support_tickets.csv'), index=False)
+        idx = self._row_index('support_tickets', ticket_id)
+        if idx is not None:
+            self._update_row('support_tickets', idx, {'status': 'Resolved', 'response': response})
             return True
         return False
 
     def get_recommendations(self, user_id, retailer_id=None, top_n=10):
+        key = (user_id, retailer_id, top_n)
+        tags = [('products', None), ('interactions', None), ('returns', None), ('surveys', user_id)]
+        cached = self.rec_cache.get(key, tags)
+        if cached is not None: return cached.copy()
+
+        # Versions are captured before computing so a concurrent write marks this result stale
+        versions = self.rec_cache.versions(tags)
+        recs = self._compute_recommendations(user_id, retailer_id, top_n)
+        self.rec_cache.put(key, versions, recs)
+        return recs.copy()
+
+    @reads
+    def _compute_recommendations(self, user_id, retailer_id=None, top_n=10):
         affinity_scores = self.get_user_affinity(user_id)
-        
-        candidates = self.products.copy()
+        cands = self._candidate_arrays(retailer_id)
+        if cands is None: return pd.DataFrame()
+
+        affinity_vec = np.array([affinity_scores.get(cat, 0) for cat in self.categories] + [0.0])
+        cat_score = affinity_vec[cands['cat_codes']]
+
+        user_inter = self._rows_by('interactions', 'user_id', user_id)
+        recency = self._recency_scores(user_inter, cands['frame']['product_id'])
+
+        scores = (0.4 * cat_score) + (0.3 * recency) + (0.2 * cands['pop']) - (0.1 * cands['risk'])
+        return self._rank_candidates(cands, scores, cat_score, top_n)
+
+    def _candidate_arrays(self, retailer_id=None):
+        """Filters recommendable products and precomputes their per-product score columns."""
+        candidates = self._rows_by('products', 'retailer_id', retailer_id) if retailer_id else self.products
         if 'active' in candidates.columns:
             candidates = candidates[candidates['active'] == True]
-            
-        if retailer_id:
-            candidates = candidates[candidates['retailer_id'] == retailer_id]
-            
-        if candidates.empty: return pd.DataFrame()
+        if candidates.empty: return None
 
-        candidates = candidates.merge(self.returns, on='product_id', how='left').fillna(0)
-        pop_counts = self.interactions['product_id'].value_counts()
-        max_pop = pop_counts.max() if not pop_counts.empty else 1
-        now = datetime.now()
-        
+        candidates = candidates[pd.to_numeric(candidates['stock_count'], errors='coerce').fillna(0) > 0]
+        if candidates.empty: return None
+        candidates = candidates.reset_index(drop=True)
+        pids = candidates['product_id']
+
+        # Unknown categories map to the trailing zero slot of the affinity vector
+        cat_lookup = {cat: i for i, cat in enumerate(self.categories)}
+        cat_codes = candidates['category'].map(cat_lookup).fillna(len(self.categories)).to_numpy(dtype=np.intp)
+
+        pop = self.popularity.product_scores(pids)
+
+        if not self.returns.empty:
+            risk_lookup = self.returns.drop_duplicates('product_id').set_index('product_id')['return_risk_score']
+            risk = pd.to_numeric(pids.map(risk_lookup), errors='coerce').fillna(0).to_numpy(dtype=float)
+        else:
+            risk = np.zeros(len(candidates))
+
+        return {'frame': candidates, 'cat_codes': cat_codes, 'pop': pop, 'risk': risk}
+
+    def _recency_scores(self, user_inter, pids, now=None):
+        """Linear 30-day recency decay of the user's last interaction with each product."""
+        if user_inter.empty: return np.zeros(len(pids))
+        now = now or datetime.now()
+        last_seen = pd.to_datetime(user_inter.groupby('product_id')['timestamp'].max())
+        days_diff = (now - pids.map(last_seen)).dt.days.to_numpy(dtype=float)
+        return np.nan_to_num(np.clip(1 - days_diff / 30, 0, None), nan=0.0)
+
+    def _rank_candidates(self, cands, scores, cat_score, top_n):
+        """Partial-sorts the candidate scores and materialises only the top-N rows."""
+        if len(scores) == 0 or top_n <= 0: return pd.DataFrame()
+        top = self._top_n_indices(scores[np.newaxis, :], top_n)[0]
+        return self._materialize_recommendations(cands, top, scores, cat_score)
+
+    def _top_n_indices(self, scores, top_n):
+        """Row-wise indices of the top-N scores of a 2-D score matrix, best first."""
+        top_n = min(top_n, scores.shape[1])
+        if top_n < scores.shape[1]:
+            top = np.argpartition(-scores, top_n - 1, axis=1)[:, :top_n]
+        else:
+            top = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind='stable')
+        return np.take_along_axis(top, order, axis=1)
+
+    def _materialize_recommendations(self, cands, top, scores, cat_score):
+        """Builds the served recommendation rows for the selected candidate indices."""
+        frame = cands['frame']
         scored_products = []
-        for _, prod in candidates.iterrows():
-            if prod['stock_count'] <= 0: continue
-            
+        for i in top:
+            prod = frame.iloc[i]
             cat = prod['category']
-            pid = prod['product_id']
-            
-            cat_score = affinity_scores.get(cat, 0)
-            
-            last_inter = self.interactions[(self.interactions['user_id'] == user_id) & (self.interactions['product_id'] == pid)]
-            recency_val = 0
-            if not last_inter.empty:
-                last_time = last_inter['timestamp'].max()
-                days_diff = (now - last_time).days
-                recency_val = max(0, 1 - (days_diff / 30))
-            
-            pop_val = pop_counts.get(pid, 0) / max_pop
-            risk_val = prod['return_risk_score']
-            
-            final_score = (0.4 * cat_score) + (0.3 * recency_val) + (0.2 * pop_val) - (0.1 * risk_val)
-            
+            pop_val = cands['pop'][i]
+
             explanation = "Recommended item"
-            if cat_score > 0.5: explanation = f"Because you like {cat}"
+            if cat_score[i] > 0.5: explanation = f"Because you like {cat}"
             elif pop_val > 0.7: explanation = "Trending now"
             elif prod['discount_pct'] > 10: explanation = f"{prod['discount_pct']}% OFF Deal"
-            
+
             scored_products.append({
-                'product_id': pid,
+                'product_id': prod['product_id'],
                 'name': prod['name'],
                 'category': cat,
                 'price': float(prod['price']),
-                'final_score': float(final_score),
+                'final_score': float(scores[i]),
                 'explanation': explanation,
                 'stock': int(prod['stock_count']),
                 'discount': int(prod['discount_pct']),
                 'combo_offer': str(prod.get('combo_offer', '')),
                 'imageUrl': str(prod.get('imageUrl', ''))
             })
-            
-        if not scored_products: return pd.DataFrame()
-        results = pd.DataFrame(scored_products).fillna(0).sort_values('final_score', ascending=False)
-        return results.head(top_n)
+        return pd.DataFrame(scored_products).fillna(0)
+
+    @reads
+    def get_batch_recommendations(self, user_ids, retailer_id=None, top_n=10, chunk_size=256):
+        """Scores many users at once: returns {user_id: recommendations DataFrame}."""
+        user_ids = list(dict.fromkeys(user_ids))
+        results = {uid: pd.DataFrame() for uid in user_ids}
+        cands = self._candidate_arrays(retailer_id)
+        if cands is None or not user_ids or top_n <= 0: return results
+
+        pids = cands['frame']['product_id']
+        base = (0.2 * cands['pop']) - (0.1 * cands['risk'])
+        now = datetime.now()
+
+        # Chunk users so the dense user x product score matrix stays bounded in memory
+        for start in range(0, len(user_ids), chunk_size):
+            chunk = user_ids[start:start + chunk_size]
+            affinity = self._affinity_matrix(chunk)
+            affinity = np.hstack([affinity, np.zeros((len(chunk), 1))])
+            cat_scores = affinity[:, cands['cat_codes']]
+            recency = self._recency_matrix(chunk, pids, now)
+
+            scores = (0.4 * cat_scores) + (0.3 * recency) + base
+            top = self._top_n_indices(scores, top_n)
+            for row, uid in enumerate(chunk):
+                results[uid] = self._materialize_recommendations(cands, top[row], scores[row], cat_scores[row])
+        return results
+
+    def _affinity_matrix(self, user_ids):
+        """Users x categories affinity, read from the maintained affinity matrix."""
+        return self.affinity.rows(user_ids)
+
+    def _recency_matrix(self, user_ids, pids, now=None):
+        """Users x candidate-products recency scores from each user's last interaction."""
+        recency = np.zeros((len(user_ids), len(pids)))
+        if self.interactions.empty: return recency
+        now = now or datetime.now()
+
+        user_lookup = {uid: i for i, uid in enumerate(user_ids)}
+        pid_lookup = pd.Series(np.arange(len(pids)), index=pids.to_numpy())
+        pid_lookup = pid_lookup[~pid_lookup.index.duplicated()]
+        inter = self.interactions.iloc[self.fk['interactions']['user_id'].get_many(user_ids)]
+        inter = inter[inter['product_id'].isin(pid_lookup.index)]
+        if inter.empty: return recency
+
+        last_seen = inter.groupby(['user_id', 'product_id'])['timestamp'].max().reset_index()
+        days_diff = (now - pd.to_datetime(last_seen['timestamp'])).dt.days.to_numpy(dtype=float)
+        rows = last_seen['user_id'].map(user_lookup).to_numpy(dtype=np.intp)
+        cols = last_seen['product_id'].map(pid_lookup).to_numpy(dtype=np.intp)
+        recency[rows, cols] = np.clip(1 - days_diff / 30, 0, None)
+
+        # Duplicate product ids among candidates share the same recency
+        if len(pid_lookup) != len(pids):
+            recency = recency[:, pids.map(pid_lookup).to_numpy(dtype=np.intp)]
+        return recency
 
     def bulk_process_products(self, retailer_id, df):
         results = {"added": 0, "updated": 0, "deleted": 0, "errors": []}
@@ -768,8 +1423,8 @@ class RecommendationEngine:
                 discount = row.get('discount', 0)
                 active = row.get('active', True)
                 
-                if pid and pid in self.products['product_id'].values:
-                    current = self.products[self.products['product_id'] == pid].iloc[0]
+                if pid and pid in self.pk['products']:
+                    current = self._row('products', self._row_index('products', pid))
                     if current['retailer_id'] != retailer_id:
                         results["errors"].append(f"Row {index}: Permission denied for {pid}")
                         continue
@@ -789,6 +1444,7 @@ class RecommendationEngine:
                 results["errors"].append(f"Row {index}: Error {str(e)}")
         return results
 
+    @reads
     def get_retailer_notifications(self, retailer_id):
         notifications = []
         my_products = self.get_retailer_products(retailer_id)
@@ -801,20 +1457,14 @@ class RecommendationEngine:
                 "action": "Restock"
             })
             
-        recent_interactions = self.interactions
-        if not recent_interactions.empty:
-            cat_views = recent_interactions[recent_interactions['action'] == 'view'].merge(
-                self.products[['product_id', 'category']], on='product_id'
-            )['category'].value_counts()
-            
-            if not cat_views.empty:
-                top_cat = cat_views.index[0]
-                notifications.append({
-                    "type": "insight",
-                    "priority": "Medium",
-                    "message": f"Market Trend: '{top_cat}' is the most viewed category today.",
-                    "action": f"Promote {top_cat} items"
-                })
+        top_cat = self.popularity.trending_category()
+        if top_cat is not None:
+            notifications.append({
+                "type": "insight",
+                "priority": "Medium",
+                "message": f"Market Trend: '{top_cat}' is the most viewed category today.",
+                "action": f"Promote {top_cat} items"
+            })
 
         if not self.users.empty:
             active_uids = self.interactions['user_id'].unique()
@@ -851,40 +1501,52 @@ class RecommendationEngine:
         
         return min(score, 100)
 
+    @reads
     def get_users_list(self):
         if self.users.empty: return []
         return self.users.fillna("").to_dict(orient='records')
 
     def toggle_user_status(self, user_id):
-        if user_id in self.users['user_id'].values:
-            idx = self.users[self.users['user_id'] == user_id].index[0]
-            current = self.users.at[idx, 'active'] if 'active' in self.users.columns else True
+        with writing(self):
+            idx = self._row_index('users', user_id)
+            if idx is None: return False
+            current = self._value('users', idx, 'active', True)
             new_status = not current
-            self.users.at[idx, 'active'] = new_status
-            self.users.to_csv(os.path.join(self.data_dir, 'users.csv'), index=False)
+            self._update_row('users', idx, {'active': new_status})
             
-            if self.use_firestore:
-                self.fs.update_document("users", user_id, {"active": new_status})
-                self.fs.log_activity("admin", "admin", f"user_{user_id}_status_{new_status}")
-            return True
-        return False
+        if self.use_firestore:
+            self.fs.update_document("users", user_id, {"active": new_status})
+            self.fs.log_activity("admin", "admin", f"user_{user_id}_status_{new_status}")
+        return True
 
-    def get_system_logs(self):
-        if self.use_firestore and self.fs and self.fs.db:
-            try:
-                logs_data = self.fs.query_collection("activity_logs")
-                # Sort by timestamp desc
-                logs_data.sort(key=lambda x: x.get('timestamp', datetime.min), reverse=True)
-                formatted = []
-                for l in logs_data[:50]:
-                    formatted.append({
-                        "level": "INFO", 
-                        "event": f"{l.get('actorRole', 'system')}: {l.get('action')}",
-                        "time": l.get('timestamp').isoformat() if hasattr(l.get('timestamp'), 'isoformat') else str(l.get('timestamp'))
-                    })
-                return formatted
-            except Exception as e:
-                print(f"Firestore log fetch failed: {e}")
+    def get_system_logs(self, limit=50, before=None):
+        """Latest activity, newest first; pass the oldest returned "time" as `before` for the next page.
+
+        Raises ValueError if `before` is not an ISO 8601 timestamp.
+        """
+        try:
+            cursor = datetime.fromisoformat(before) if before else None
+        except ValueError:
+            raise ValueError(f"Invalid 'before' cursor: {before!r}")
+        if self.use_firestore and self.fs:
+            # Timestamps are logged as naive datetimes; Firestore hands them back as UTC
+            if cursor is not None and cursor.tzinfo is not None: cursor = cursor.replace(tzinfo=None)
+            logs_data = self.fs.recent_activity.latest(limit, cursor)
+            failed = False
+            # Entries older than the ring buffer come from Firestore, ordered and limited server-side
+            if len(logs_data) < limit and self.fs.db:
+                try:
+                    oldest = logs_data[-1]['timestamp'] if logs_data else cursor
+                    logs_data += self.fs.query_latest("activity_logs", "timestamp", limit - len(logs_data), before=oldest)
+                except Exception as e:
+                    print(f"Firestore log fetch failed: {e}")
+                    failed = True
+            if logs_data or cursor or (self.fs.db and not failed):
+                return [{
+                    "level": "INFO", 
+                    "event": f"{l.get('actorRole', 'system')}: {l.get('action')}",
+                    "time": l.get('timestamp').isoformat() if hasattr(l.get('timestamp'), 'isoformat') else str(l.get('timestamp'))
+                } for l in logs_data]
 
         # Fallback to mock
         return [
@@ -892,8 +1554,11 @@ class RecommendationEngine:
             for i, e in enumerate(["GET /products", "POST /login", "GET /recs", "POST /order", "GET /admin/stats"])
         ]
 
+    @reads
     def create_return_request(self, user_id, order_id, product_id, reason, condition="Good", image_data=None):
-        order = self.orders[(self.orders['order_id'] == order_id) & (self.orders['user_id'] == user_id)]
+        # Older order ids are not unique, so match within the user's own orders
+        user_orders = self._rows_by('orders', 'user_id', user_id)
+        order = user_orders[user_orders['order_id'] == order_id] if not user_orders.empty else user_orders
         if order.empty:
             raise ValueError("Order not found or verification failed.")
 
@@ -944,6 +1609,8 @@ class RecommendationEngine:
                 print(f"Image analysis failed: {e}")
                 fraud_score = 50 # Flag for manual review if image is corrupted
 
+        now = datetime.now()
+        req_id = self._new_id('RET', now)
         new_req = {
             'request_id': req_id,
             'user_id': user_id,
@@ -955,12 +1622,12 @@ class RecommendationEngine:
             'fraud_score': fraud_score,
             'image_path': image_path,
             'status': 'Pending', 
-            'admin_notes': ''
+            'admin_notes': '',
+            'timestamp': now.isoformat()
         }
-        
-        req_path = os.path.join(self.data_dir, 'return_requests.csv')
-        df = pd.DataFrame([new_req])
-        df.to_csv(req_path, mode='a', header=not os.path.exists(req_path), index=False)
+        with writing(self):
+            self._insert_rows('return_requests', [new_req])
+            self._own_derived('trust').add_return(user_id)
         
         if self.use_firestore:
             self.fs.add_document("returns", {
@@ -972,80 +1639,62 @@ class RecommendationEngine:
                 "status": "Pending",
                 "fraudScore": fraud_score,
                 "imagePath": image_path,
-                "requestedAt": datetime.now()
+                "requestedAt": now
             }, doc_id=req_id)
             self.fs.log_activity(user_id, "user", f"return_requested_{req_id}")
             
         return req_id
 
     def get_pending_returns(self):
-        req_path = os.path.join(self.data_dir, 'return_requests.csv')
-        if not os.path.exists(req_path): return []
-        df = pd.read_csv(req_path).fillna(0)
-        if df.empty: return []
-        pending = df[df['status'] == 'Pending'].copy()
-        return pending.to_dict(orient='records')
+        return self._rows_by('return_requests', 'status', 'Pending').to_dict(orient='records')
 
     def get_user_returns(self, user_id):
-        req_path = os.path.join(self.data_dir, 'return_requests.csv')
-        if not os.path.exists(req_path): return []
-        df = pd.read_csv(req_path).fillna(0)
-        if df.empty: return []
-        return df[df['user_id'] == user_id].to_dict(orient='records')
+        return self._rows_by('return_requests', 'user_id', user_id).to_dict(orient='records')
 
     def get_retailer_returns(self, retailer_id):
-        req_path = os.path.join(self.data_dir, 'return_requests.csv')
-        if not os.path.exists(req_path): return []
-        df = pd.read_csv(req_path).fillna(0)
-        if df.empty: return []
-        return df[(df['retailer_id'] == retailer_id) & (df['status'] == 'Approved')].to_dict(orient='records')
+        r_returns = self._rows_by('return_requests', 'retailer_id', retailer_id)
+        if r_returns.empty: return []
+        return r_returns[r_returns['status'] == 'Approved'].to_dict(orient='records')
 
     def admin_process_return(self, request_id, decision, notes=""):
-        req_path = os.path.join(self.data_dir, 'return_requests.csv')
-        if not os.path.exists(req_path): return False
-        
-        df = pd.read_csv(req_path).fillna(0)
-        if request_id in df['request_id'].values:
-            idx = df[df['request_id'] == request_id].index[0]
-            df.at[idx, 'status'] = decision 
-            df.at[idx, 'admin_notes'] = notes
-            df.to_csv(req_path, index=False)
+        with writing(self):
+            idx = self._row_index('return_requests', request_id)
+            if idx is None: return False
+            self._update_row('return_requests', idx, {'status': decision, 'admin_notes': notes})
             
-            if self.use_firestore:
-                self.fs.update_document("returns", request_id, {
-                    "status": decision,
-                    "adminNotes": notes
-                })
-                self.fs.log_activity("admin", "admin", f"return_{request_id}_{decision}")
-            return True
-        return False
+        if self.use_firestore:
+            self.fs.update_document("returns", request_id, {
+                "status": decision,
+                "adminNotes": notes
+            })
+            self.fs.log_activity("admin", "admin", f"return_{request_id}_{decision}")
+        return True
 
     def toggle_retailer_status(self, retailer_id):
-        if retailer_id in self.retailers['retailer_id'].values:
-            idx = self.retailers[self.retailers['retailer_id'] == retailer_id].index[0]
-            current = self.retailers.at[idx, 'status']
+        with writing(self):
+            idx = self._row_index('retailers', retailer_id)
+            if idx is None: return False
+            current = self._value('retailers', idx, 'status')
             new_status = 'Banned' if current == 'Approved' else 'Approved'
-            self.retailers.at[idx, 'status'] = new_status
-            self.retailers.to_csv(os.path.join(self.data_dir, 'retailers.csv'), index=False)
+            self._update_row('retailers', idx, {'status': new_status})
             
-            if self.use_firestore:
-                self.fs.update_document("retailers", retailer_id, {"approvedStatus": new_status})
-                self.fs.log_activity("admin", "admin", f"retailer_{retailer_id}_{new_status}")
-            return True
-        return False
+        if self.use_firestore:
+            self.fs.update_document("retailers", retailer_id, {"approvedStatus": new_status})
+            self.fs.log_activity("admin", "admin", f"retailer_{retailer_id}_{new_status}")
+        return True
 
     def register_retailer(self, name, location, delivery_charge=0):
-        rid = f"R{str(len(self.retailers) + 1).zfill(3)}"
-        new_retailer = {
-            'retailer_id': rid,
-            'name': name,
-            'location': location,
-            'delivery_charge': delivery_charge,
-            'rating': 5.0,
-            'status': 'Pending' 
-        }
-        self.retailers = pd.concat([self.retailers, pd.DataFrame([new_retailer])], ignore_index=True)
-        self.retailers.to_csv(os.path.join(self.data_dir, 'retailers.csv'), index=False)
+        with writing(self):
+            rid = f"R{str(len(self._base('retailers')) + 1).zfill(3)}"
+            new_retailer = {
+                'retailer_id': rid,
+                'name': name,
+                'location': location,
+                'delivery_charge': delivery_charge,
+                'rating': 5.0,
+                'status': 'Pending' 
+            }
+            self._insert_rows('retailers', [new_retailer])
         
         if self.use_firestore:
             self.fs.add_document("retailers", {
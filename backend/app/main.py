@@ -1,8 +1,9 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Body, Depends, Form
+from fastapi import FastAPI, UploadFile, File, HTTPException, Body, Depends, Form, Query
 from fastapi.middleware.cors import CORSMiddleware
 from typing import List, Dict, Optional
 import os
 import sys
+from datetime import datetime
 
 # Add project root to path if needed, though standard relative imports usually work
 # sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -10,6 +11,7 @@ import sys
 from . import services
 from .models import Product, ShelfZone, OptimizationResult
 from .logic_engine import RecommendationEngine
+from .table_store import StoreLockedError
 from .fraud_detection.router import router as fraud_router
 from pydantic import BaseModel
 
@@ -39,6 +41,15 @@ class SurveyModel(BaseModel):
     age: Optional[int] = None
     gender: Optional[str] = None
 
+class BatchRecommendationModel(BaseModel):
+    user_ids: List[str]
+    retailer_id: Optional[str] = None
+    top_n: int = 10
+
+class TrustBatchModel(BaseModel):
+    user_ids: Optional[List[str]] = None
+    lowest_n: Optional[int] = None
+
 class TicketModel(BaseModel):
     user_id: str
     role: str
@@ -64,14 +75,28 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_DIR = os.path.join(BASE_DIR, "data")
 
 # --- Initialize Engines ---
-recommender = RecommendationEngine(data_dir=DATA_DIR)
+recommender = RecommendationEngine(
+    data_dir=DATA_DIR,
+    popularity_half_life_days=float(os.getenv("POPULARITY_HALF_LIFE_DAYS", "14")),
+    firestore_write_behind=os.getenv("FIRESTORE_WRITE_BEHIND", "1") == "1",
+    background_sync=True,
+    # SQLite lets several uvicorn workers share state; CSV storage refuses a second process
+    storage=os.getenv("ENGINE_STORAGE", "sqlite")
+)
 # Load data initially
 try:
     recommender.load_data()
     print(f"Recommender loaded data from {DATA_DIR}")
+except StoreLockedError:
+    raise
 except Exception as e:
     print(f"Failed to load recommender data: {e}")
 
+@app.on_event("shutdown")
+def shutdown_engine():
+    # Flush the write-ahead log into fresh CSV snapshots (or checkpoint SQLite) and drain the Firestore queue
+    recommender.close()
+
 # --- Mount Sub-Apps/Routers ---
 app.include_router(fraud_router)
 
@@ -86,9 +111,9 @@ def get_products():
     return services.load_products()
 
 @app.get("/shelf-layout")
-def get_shelf_layout(retailer_id: Optional[str] = None):
+def get_shelf_layout(retailer_id: Optional[str] = None, window_days: Optional[int] = None):
     if retailer_id:
-        return recommender.get_retailer_shelf(retailer_id)
+        return recommender.get_retailer_shelf(retailer_id, window_days)
     return services.load_shelf_layout()
 
 @app.get("/analytics/performance")
@@ -96,9 +121,9 @@ def get_analytics():
     return services.get_product_performance()
 
 @app.get("/optimization/shelf-recommendations")
-def get_shelf_recommendations(retailer_id: Optional[str] = None):
+def get_shelf_recommendations(retailer_id: Optional[str] = None, window_days: Optional[int] = None):
     if retailer_id:
-        return recommender.get_shelf_recommendations(retailer_id)
+        return recommender.get_shelf_recommendations(retailer_id, window_days)
     return services.generate_recommendations()
 
 # --- Customer & Retailer Interaction (Recommender Engine) ---
@@ -152,6 +177,15 @@ def get_user_recommendations(user_id: str, retailer_id: Optional[str] = None):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/recommendations/batch")
+def get_batch_recommendations(req: BatchRecommendationModel):
+    """Recommendations for many users in one call: {user_id: [recommendations]}"""
+    try:
+        recs = recommender.get_batch_recommendations(req.user_ids, retailer_id=req.retailer_id, top_n=req.top_n)
+        return {uid: ([] if df.empty else df.to_dict(orient="records")) for uid, df in recs.items()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/order")
 def place_order(user_id: str = Body(...), retailer_id: str = Body(...), items: Dict[str, int] = Body(...)):
     """
@@ -165,9 +199,20 @@ def place_order(user_id: str = Body(...), retailer_id: str = Body(...), items: D
 
 @app.post("/cart/update")
 def update_cart(user_id: str = Body(...), store_id: str = Body(...), items: Dict[str, int] = Body(...)):
-    if recommender.update_cart(user_id, store_id, items):
-        return {"status": "success"}
-    raise HTTPException(status_code=500, detail="Firestore not enabled")
+    recommender.update_cart(user_id, store_id, items)
+    return {"status": "success"}
+
+@app.post("/cart/add")
+def add_to_cart(user_id: str = Body(...), store_id: str = Body(...), product_id: str = Body(...), quantity: int = Body(1)):
+    return recommender.add_to_cart(user_id, store_id, product_id, quantity)
+
+@app.post("/cart/set")
+def set_cart_quantity(user_id: str = Body(...), store_id: str = Body(...), product_id: str = Body(...), quantity: int = Body(...)):
+    return recommender.set_cart_quantity(user_id, store_id, product_id, quantity)
+
+@app.delete("/cart/{user_id}/{store_id}/{product_id}")
+def remove_from_cart(user_id: str, store_id: str, product_id: str):
+    return recommender.remove_from_cart(user_id, store_id, product_id)
 
 @app.get("/cart/{user_id}/{store_id}")
 def get_cart(user_id: str, store_id: str):
@@ -240,13 +285,33 @@ def toggle_user(user_id: str):
     raise HTTPException(status_code=404, detail="User not found")
 
 @app.get("/admin/logs")
-def get_logs():
-    return recommender.get_system_logs()
+def get_logs(limit: int = Query(50, ge=1, le=500), before: Optional[str] = None):
+    try:
+        return recommender.get_system_logs(limit, before)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/admin/stats")
 def get_admin_stats():
     return recommender.get_platform_stats()
 
+@app.get("/admin/cache/stats")
+def get_cache_stats():
+    """Hit/miss counters of the recommendation result cache"""
+    return recommender.rec_cache.stats()
+
+@app.get("/admin/firestore/queue")
+def get_firestore_queue_stats():
+    """Depth, lag and retry counters of the Firestore write-behind queue"""
+    if not recommender.fs: return {"enabled": False}
+    return recommender.fs.queue_stats() | {"activity_log": recommender.fs.activity_sink.stats()}
+
+@app.post("/admin/user-trust/batch")
+def get_user_trust_batch(req: TrustBatchModel):
+    if req.user_ids is None and req.lowest_n is None:
+        raise HTTPException(status_code=400, detail="Provide user_ids or lowest_n")
+    return recommender.get_trust_scores(req.user_ids, req.lowest_n)
+
 @app.get("/admin/user-trust/{user_id}")
 def get_user_trust(user_id: str):
     return {"score": recommender.get_user_trust_score(user_id)}
@@ -289,17 +354,17 @@ def get_retailer_orders(retailer_id: str):
     return recommender.get_retailer_orders(retailer_id)
 
 @app.get("/retailers/{retailer_id}/analytics")
-def get_retailer_analytics(retailer_id: str):
-    return recommender.get_retailer_analytics(retailer_id)
+def get_retailer_analytics(retailer_id: str, window_days: Optional[int] = None):
+    return recommender.get_retailer_analytics(retailer_id, window_days)
 
 @app.put("/retailers/{retailer_id}/products/{product_id}")
 def update_product(retailer_id: str, product_id: str, prod: ProductUpdateModel):
     """Update an existing product"""
-    if product_id not in recommender.products['product_id'].values:
+    product_row = recommender.get_product(product_id)
+    if product_row is None:
         raise HTTPException(status_code=404, detail="Product not found")
     
     # Verify ownership
-    product_row = recommender.products[recommender.products['product_id'] == product_id].iloc[0]
     if product_row['retailer_id'] != retailer_id:
         raise HTTPException(status_code=403, detail="Permission denied")
     
@@ -311,17 +376,16 @@ def update_product(retailer_id: str, product_id: str, prod: ProductUpdateModel):
         new_discount=prod.discount
     ):
         # Update other fields if provided
-        idx = recommender.products[recommender.products['product_id'] == product_id].index[0]
-        if prod.name: recommender.products.at[idx, 'name'] = prod.name
-        if prod.category: recommender.products.at[idx, 'category'] = prod.category
-        if prod.combo_offer is not None: recommender.products.at[idx, 'combo_offer'] = prod.combo_offer
-        if prod.imageUrl is not None: recommender.products.at[idx, 'imageUrl'] = prod.imageUrl
-        
-        recommender.products.to_csv(os.path.join(recommender.data_dir, 'products.csv'), index=False)
+        fields = {}
+        if prod.name: fields['name'] = prod.name
+        if prod.category: fields['category'] = prod.category
+        if prod.combo_offer is not None: fields['combo_offer'] = prod.combo_offer
+        if prod.imageUrl is not None: fields['imageUrl'] = prod.imageUrl
+        recommender.update_product_fields(product_id, **fields)
         
         # Sync to Firestore
         if recommender.use_firestore:
-            recommender.fs.sync_product(product_id, recommender.products.loc[idx].to_dict())
+            recommender.fs.sync_product(product_id, recommender.get_product(product_id).to_dict())
         
         return {"status": "success"}
     raise HTTPException(status_code=400, detail="Failed to update product")
@@ -402,11 +466,7 @@ async def upload_product_image(retailer_id: str, product_id: str, image: UploadF
     image_url = f"/uploads/products/{filename}"
     
     # Update product with image URL
-    if product_id in recommender.products['product_id'].values:
-        idx = recommender.products[recommender.products['product_id'] == product_id].index[0]
-        recommender.products.at[idx, 'imageUrl'] = image_url
-        recommender.products.to_csv(os.path.join(recommender.data_dir, 'products.csv'), index=False)
-        
+    if recommender.update_product_fields(product_id, imageUrl=image_url):
         if recommender.use_firestore:
             recommender.fs.update_document("products", product_id, {"imageUrl": image_url})
         
@@ -0,0 +1,210 @@
+import copy
+import random
+import string
+import threading
+import time
+from datetime import datetime
+
+try:
+    from google.api_core.exceptions import NotFound
+except ImportError:  # google-api-core ships with firebase-admin; keep the backend usable without it
+    class NotFound(Exception):
+        pass
+
+
+def _auto_id():
+    return ''.join(random.choices(string.ascii_letters + string.digits, k=20))
+
+
+_OPERATORS = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    'in': lambda a, b: a in b,
+    'not-in': lambda a, b: a not in b,
+    'array-contains': lambda a, b: isinstance(a, list) and b in a,
+    'array-contains-any': lambda a, b: isinstance(a, list) and any(v in a for v in b),
+}
+
+
+class InMemoryFirestore:
+    """Thread-safe in-process stand-in for the google.cloud.firestore Client.
+
+    Implements the subset FirestoreService uses: collection(), document refs
+    with get/set/update/delete, collection add(), where/order_by/limit
+    queries, and atomic write batches. Every call that would be a network
+    round trip sleeps latency_seconds, so write patterns can be benchmarked
+    and profiled offline. Documents are deep-copied in and out, as they would
+    be serialized over the wire.
+    """
+
+    def __init__(self, latency_seconds=0.0):
+        self.latency_seconds = latency_seconds
+        self._collections = {}
+        self._lock = threading.RLock()
+        self.round_trips = 0
+
+    def _round_trip(self):
+        with self._lock:
+            self.round_trips += 1
+        if self.latency_seconds: time.sleep(self.latency_seconds)
+
+    def _docs(self, collection):
+        return self._collections.setdefault(collection, {})
+
+    def collection(self, name):
+        return MemoryCollection(self, name)
+
+    def batch(self):
+        return MemoryWriteBatch(self)
+
+    # Unlocked primitives; callers hold self._lock
+
+    def _set(self, collection, doc_id, data, merge=False):
+        docs = self._docs(collection)
+        if merge and doc_id in docs:
+            docs[doc_id].update(copy.deepcopy(data))
+        else:
+            docs[doc_id] = copy.deepcopy(data)
+
+    def _update(self, collection, doc_id, data):
+        docs = self._docs(collection)
+        if doc_id not in docs: raise NotFound(f"No document to update: {collection}/{doc_id}")
+        docs[doc_id].update(copy.deepcopy(data))
+
+    def _delete(self, collection, doc_id):
+        self._docs(collection).pop(doc_id, None)
+
+
+class MemorySnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self.exists else None
+
+
+class MemoryDocument:
+    def __init__(self, client, collection, doc_id=None):
+        self._client = client
+        self.collection_name = collection
+        self.id = doc_id or _auto_id()
+
+    def get(self):
+        self._client._round_trip()
+        with self._client._lock:
+            return MemorySnapshot(self.id, self._client._docs(self.collection_name).get(self.id))
+
+    def set(self, data, merge=False):
+        self._client._round_trip()
+        with self._client._lock:
+            self._client._set(self.collection_name, self.id, data, merge)
+
+    def update(self, data):
+        self._client._round_trip()
+        with self._client._lock:
+            self._client._update(self.collection_name, self.id, data)
+
+    def delete(self):
+        self._client._round_trip()
+        with self._client._lock:
+            self._client._delete(self.collection_name, self.id)
+
+
+class MemoryQuery:
+    def __init__(self, client, collection, filters=(), order=(), limit_count=None):
+        self._client = client
+        self.collection_name = collection
+        self._filters = tuple(filters)
+        self._order = tuple(order)
+        self._limit = limit_count
+
+    def where(self, field, op, value):
+        if op not in _OPERATORS: raise ValueError(f"Unsupported operator: {op}")
+        return MemoryQuery(self._client, self.collection_name, self._filters + ((field, op, value),),
+                           self._order, self._limit)
+
+    def order_by(self, field, direction="ASCENDING"):
+        return MemoryQuery(self._client, self.collection_name, self._filters,
+                           self._order + ((field, direction),), self._limit)
+
+    def limit(self, count):
+        return MemoryQuery(self._client, self.collection_name, self._filters, self._order, count)
+
+    def _matches(self, data):
+        for field, op, value in self._filters:
+            # Like Firestore, documents missing the field never match
+            if field not in data: return False
+            try:
+                if not _OPERATORS[op](data[field], value): return False
+            except TypeError:
+                return False
+        return True
+
+    def stream(self):
+        self._client._round_trip()
+        with self._client._lock:
+            docs = [(doc_id, data) for doc_id, data in self._client._docs(self.collection_name).items()
+                    if self._matches(data)]
+        # Ordered fields must be present; apply sort keys from last to first (stable sort)
+        for field, direction in reversed(self._order):
+            docs = [d for d in docs if field in d[1]]
+            docs.sort(key=lambda d: d[1][field], reverse=str(direction).upper() == "DESCENDING")
+        if self._limit is not None: docs = docs[:self._limit]
+        return iter([MemorySnapshot(doc_id, copy.deepcopy(data)) for doc_id, data in docs])
+
+    def get(self):
+        return list(self.stream())
+
+
+class MemoryCollection(MemoryQuery):
+    def __init__(self, client, name):
+        super().__init__(client, name)
+
+    def document(self, doc_id=None):
+        return MemoryDocument(self._client, self.collection_name, doc_id)
+
+    def add(self, data):
+        doc = self.document()
+        doc.set(data)
+        return datetime.now(), doc
+
+
+class MemoryWriteBatch:
+    """Buffers writes and applies them all-or-nothing in one round trip on commit()."""
+
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, ref, data, merge=False):
+        self._writes.append(('set', ref, data, merge))
+
+    def update(self, ref, data):
+        self._writes.append(('update', ref, data, False))
+
+    def delete(self, ref):
+        self._writes.append(('delete', ref, None, False))
+
+    def commit(self):
+        self._client._round_trip()
+        client = self._client
+        with client._lock:
+            # Check updates against the state the batch itself produces before touching anything
+            exists = {}
+            for op, ref, _, _ in self._writes:
+                key = (ref.collection_name, ref.id)
+                if key not in exists: exists[key] = ref.id in client._docs(ref.collection_name)
+                if op == 'update' and not exists[key]:
+                    raise NotFound(f"No document to update: {ref.collection_name}/{ref.id}")
+                exists[key] = op != 'delete'
+            for op, ref, data, merge in self._writes:
+                if op == 'set': client._set(ref.collection_name, ref.id, data, merge)
+                elif op == 'update': client._update(ref.collection_name, ref.id, data)
+                else: client._delete(ref.collection_name, ref.id)
+        self._writes = []
@@ -0,0 +1,137 @@
+import math
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+from .snapshot import layered_copy
+
+
+def _to_seconds(ts):
+    # Naive times count as UTC, as in build(); "now" must follow the same convention
+    return pd.Timestamp(ts if ts is not None else datetime.now()).timestamp()
+
+
+class DecayedCounter:
+    """Exponentially time-decayed counts per key with O(1) updates and reads.
+
+    Each event of weight w at time t contributes w * exp(rate * (t - origin)),
+    so adding an event never touches other keys and ratios between keys are
+    already decayed to a common reference time. The origin is moved forward
+    (an O(keys) rescale) only when the exponent would overflow.
+    """
+
+    MAX_EXPONENT = 500.0
+
+    def __init__(self, half_life_days=14.0):
+        self.half_life_days = float(half_life_days)
+        self.rate = math.log(2) / (self.half_life_days * 86400.0)
+        self._origin = None
+        self._scaled = {}
+        self._max_key = None
+        self._max = 0.0
+
+    def load(self, keys, seconds, weights=None):
+        """Replaces all counts from parallel arrays of keys and event times (epoch seconds)."""
+        self._scaled, self._max_key, self._max = {}, None, 0.0
+        seconds = np.asarray(seconds, dtype=float)
+        valid = ~np.isnan(seconds)
+        if not valid.any(): return
+        keys, seconds = np.asarray(keys)[valid], seconds[valid]
+        if weights is not None: weights = np.asarray(weights, dtype=float)[valid]
+        self._origin = float(seconds.max())
+        contrib = np.exp(self.rate * (seconds - self._origin))
+        if weights is not None: contrib = contrib * weights
+        sums = pd.Series(contrib, index=keys).groupby(level=0).sum()
+        self._scaled = sums.to_dict()
+        if not sums.empty:
+            self._max_key, self._max = sums.idxmax(), float(sums.max())
+
+    def copy(self):
+        """A copy for a writer; it shares the counts with this one (see layered_copy)."""
+        clone = DecayedCounter(self.half_life_days)
+        clone._origin, clone._max_key, clone._max = self._origin, self._max_key, self._max
+        clone._scaled = layered_copy(self._scaled)
+        return clone
+
+    def add(self, key, ts=None, weight=1.0):
+        t = _to_seconds(ts)
+        if self._origin is None: self._origin = t
+        exponent = self.rate * (t - self._origin)
+        if exponent > self.MAX_EXPONENT:
+            self._rebase(t)
+            exponent = 0.0
+        value = self._scaled.get(key, 0.0) + weight * math.exp(exponent)
+        self._scaled[key] = value
+        # Counts only ever grow between rebases, so the running max stays exact
+        if value > self._max: self._max_key, self._max = key, value
+
+    def _rebase(self, t):
+        factor = math.exp(-self.rate * (t - self._origin))
+        self._scaled = {k: v * factor for k, v in self._scaled.items()}
+        self._max *= factor
+        self._origin = t
+
+    def value(self, key, now=None):
+        """Decayed count of one key as of `now`."""
+        if self._origin is None: return 0.0
+        return self._scaled.get(key, 0.0) * math.exp(-self.rate * (_to_seconds(now) - self._origin))
+
+    def relative(self, key):
+        """Count of one key relative to the most popular key (0..1)."""
+        return self._scaled.get(key, 0.0) / self._max if self._max > 0 else 0.0
+
+    def relative_many(self, keys):
+        if self._max <= 0: return np.zeros(len(keys))
+        return np.fromiter((self._scaled.get(k, 0.0) for k in keys), dtype=float, count=len(keys)) / self._max
+
+    def top(self):
+        return self._max_key
+
+
+class PopularityIndex:
+    """Time-decayed interaction popularity per product, per retailer and of viewed categories."""
+
+    def __init__(self, half_life_days=14.0):
+        self.half_life_days = half_life_days
+        self.products = DecayedCounter(half_life_days)
+        self.retailers = DecayedCounter(half_life_days)
+        self.category_views = DecayedCounter(half_life_days)
+
+    def copy(self):
+        clone = PopularityIndex(self.half_life_days)
+        clone.products, clone.retailers, clone.category_views = (
+            self.products.copy(), self.retailers.copy(), self.category_views.copy())
+        return clone
+
+    def build(self, interactions, products):
+        """Rebuilds every counter from the full interaction history."""
+        if interactions.empty:
+            for counter in (self.products, self.retailers, self.category_views): counter.load([], [])
+            return
+        seconds = (pd.to_datetime(interactions['timestamp']) - pd.Timestamp(0)).dt.total_seconds().to_numpy()
+        self.products.load(interactions['product_id'].to_numpy(), seconds)
+
+        meta = interactions[['product_id', 'action']].merge(
+            products[['product_id', 'retailer_id', 'category']].drop_duplicates('product_id'),
+            on='product_id', how='left'
+        )
+        has_retailer = meta['retailer_id'].notna().to_numpy()
+        self.retailers.load(meta['retailer_id'].to_numpy()[has_retailer], seconds[has_retailer])
+        is_view = ((meta['action'] == 'view') & meta['category'].notna()).to_numpy()
+        self.category_views.load(meta['category'].to_numpy()[is_view], seconds[is_view])
+
+    def record(self, product_id, retailer_id=None, category=None, action=None, ts=None):
+        """Counts one interaction as it is appended."""
+        self.products.add(product_id, ts)
+        if retailer_id is not None: self.retailers.add(retailer_id, ts)
+        if action == 'view' and category is not None: self.category_views.add(category, ts)
+
+    def product_scores(self, product_ids):
+        """Popularity of each product relative to the most popular one (0..1)."""
+        return self.products.relative_many(list(product_ids))
+
+    def retailer_score(self, retailer_id, now=None):
+        return self.retailers.value(retailer_id, now)
+
+    def trending_category(self):
+        return self.category_views.top()
@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+
+class VersionedLRUCache:
+    """LRU cache whose entries are tagged with the versions of the data they were built from.
+
+    Writers call bump() for the table (and optionally the key within it) they
+    changed. An entry is served only while every version it was tagged with is
+    still current, so invalidation is exact without scanning the cache.
+    """
+
+    def __init__(self, maxsize=1024, ttl_seconds=None):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._versions = defaultdict(int)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def bump(self, table, key=None):
+        """Marks a table (or one key of it) as changed."""
+        with self._lock:
+            self._versions[(table, key)] += 1
+
+    def versions(self, tags):
+        """Current versions of the given (table, key) tags; capture before computing a value."""
+        with self._lock:
+            return tuple(self._versions[tag] for tag in tags)
+
+    def get(self, key, tags):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, versions, stored_at = entry
+                current = tuple(self._versions[tag] for tag in tags)
+                expired = self.ttl_seconds is not None and time.monotonic() - stored_at > self.ttl_seconds
+                if versions == current and not expired:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.invalidations += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, versions, value):
+        with self._lock:
+            self._entries[key] = (value, versions, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "table_versions": {t: v for (t, k), v in self._versions.items() if k is None}
+            }
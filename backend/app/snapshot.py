@@ -0,0 +1,111 @@
+import functools
+from collections import ChainMap
+from contextlib import contextmanager
+
+# Keys a layered copy collects before they are merged into a new shared base
+MAX_OVERLAY = 1024
+
+
+def layered_copy(mapping):
+    """A copy of a dict-like store that shares the bulk of it with the original.
+
+    The copy is a ChainMap whose first map takes every change; the shared base
+    is never changed in place. Once the changes outgrow MAX_OVERLAY keys, the
+    next copy merges them into a new base, so a copy costs O(overlay) and not
+    O(keys).
+    """
+    if not isinstance(mapping, ChainMap): return ChainMap({}, mapping)
+    overlay, base = mapping.maps[0], mapping.maps[1]
+    if len(overlay) > MAX_OVERLAY: return ChainMap({}, {**base, **overlay})
+    return ChainMap(dict(overlay), base)
+
+
+class EngineSnapshot:
+    """One published version of the engine's tables, their indexes and the stores derived from them.
+
+    A published snapshot is never changed again. A writer works on a clone
+    that shares frames and indexes with the published version, and publishes
+    the clone by swapping a single reference, so readers always see either
+    all of a write or none of it. A derived store (affinity, popularity, ...)
+    is copied by the first writer that updates it in place (see
+    layered_copy), or swapped in whole when it is rebuilt.
+
+    Row updates do not copy the shared frame: they are kept as per-row
+    patches ({row label: {column: value}}) on top of it. Readers that need a
+    whole table get it merged once per snapshot (see merged); the next clone
+    takes such a merged frame as its base.
+    """
+
+    def __init__(self, tables, pk, fk, derived, version=0, patches=None):
+        self.tables = tables  # name -> base frame
+        self.pk = pk
+        self.fk = fk
+        self.derived = derived  # name -> derived store
+        self.version = version
+        self.patches = patches if patches is not None else {}  # name -> {row label: {column: value}}
+        self.merged = {}  # name -> base frame with its patches applied, filled by the first reader that needs it
+        self.owned_patches = set()  # tables whose patch dict this clone copied and may change in place
+        self.owned_indexes = set()  # tables whose indexes this clone copied
+        self.owned_derived = set()  # derived stores this clone copied or rebuilt
+        self.bumps = []  # result-cache invalidations, applied once the clone is published
+
+    def clone(self):
+        tables, patches = dict(self.tables), dict(self.patches)
+        for name, frame in list(self.merged.items()):
+            tables[name], patches[name] = frame, {}
+        return EngineSnapshot(tables, dict(self.pk), dict(self.fk), dict(self.derived), self.version + 1, patches)
+
+
+def reads(method):
+    """Pins the current snapshot for the calling thread while the method runs."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        local = self._local
+        if getattr(local, 'snapshot', None) is not None:
+            return method(self, *args, **kwargs)
+        local.snapshot = self._snapshot
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            local.snapshot = None
+    return wrapper
+
+
+@contextmanager
+def writing(engine):
+    """Serializes the block with all other writers and publishes its changes atomically.
+
+    Yields the working snapshot, caught up with commits from other processes
+    sharing the storage. A writer nested in another joins the outermost one. If the block raises, its in-memory changes are dropped,
+    unless it had already logged a durable write; then they are published so
+    memory stays in line with the log.
+    """
+    local = engine._local
+    if getattr(local, 'working', None) is not None:
+        yield local.working
+        return
+    with engine.store.lock:
+        work = engine._snapshot.clone()
+        seq = engine.store.seq
+        pinned = getattr(local, 'snapshot', None)
+        local.working = local.snapshot = work
+        try:
+            # Start from the latest state: other worker processes may have committed since
+            engine._apply_changes()
+            yield work
+        except BaseException:
+            if engine.store.seq != seq: engine._publish(work)
+            raise
+        finally:
+            local.working = None
+            local.snapshot = pinned
+        engine._publish(work)
+
+
+def writes(method):
+    """Runs the whole method as one writer (see writing)."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with writing(self):
+            return method(self, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,324 @@
+import json
+import math
+import os
+import sqlite3
+import sys
+import threading
+import uuid
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+from .table_store import TableStore, _json_default
+
+
+def _sql_value(value):
+    if isinstance(value, np.generic): value = value.item()
+    if isinstance(value, (datetime, date, pd.Timestamp)): return value.isoformat()
+    if isinstance(value, float) and math.isnan(value): return None
+    if isinstance(value, (dict, list)): return json.dumps(value)
+    return value
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+class ProcessLock:
+    """Re-entrant lock shared by the threads of this process and by other processes.
+
+    The cross-process part is an exclusive transaction on a side database
+    file, so it works wherever SQLite does, and the OS drops it if the holding
+    process dies.
+    """
+
+    def __init__(self, path, timeout=60.0):
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=timeout)
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                self._conn.execute('BEGIN EXCLUSIVE')
+            except BaseException:
+                self._thread_lock.release()
+                raise
+        self._depth += 1
+        return True
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0: self._conn.execute('ROLLBACK')
+        self._thread_lock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def close(self):
+        self._conn.close()
+
+
+class SQLiteStore:
+    """Engine tables kept in one SQLite database (WAL mode) instead of CSVs plus logs.
+
+    Drop-in for TableStore: read() loads a table, append()/commit() persist
+    mutations, and replay() has nothing to apply because every write already
+    went to the database. Each append() or commit() is one SQLite
+    transaction, so a multi-table commit stays all-or-nothing. The periodic
+    "compaction" checkpoints the SQLite WAL into the main database file.
+
+    Columns are declared without a type, so values keep the type they were
+    written with, and columns first seen in a write are added on the fly.
+    Primary-key and foreign-key columns get (non-unique) indexes.
+
+    Several processes can share the database. lock is a ProcessLock, so
+    writers are serialized across processes, and every transaction also
+    records its operations in the _changes table (the change feed). seq is
+    the last feed entry this process has seen; changes() hands over the
+    entries other processes committed since.
+    """
+
+    CHANGES_TABLE = '_changes'
+
+    def __init__(self, db_path, keys, indexes=None, fsync=True, keep_changes=10000):
+        self.db_path = db_path
+        self.keys = dict(keys)  # table -> primary key column (None for append-only tables)
+        self.indexes = {table: list(cols) for table, cols in (indexes or {}).items()}
+        self.keep_changes = keep_changes
+        self.origin = uuid.uuid4().hex  # tags this process's feed entries
+        self.lock = ProcessLock(db_path + '.lock')
+        self.seq = 0
+        self._conn_lock = threading.RLock()
+        self._columns = {}  # table -> set of column names
+        self._stop = threading.Event()
+        self._compactor = None
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=60.0)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(f"PRAGMA synchronous={'FULL' if fsync else 'NORMAL'}")
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS {self.CHANGES_TABLE} '
+                          '(seq INTEGER PRIMARY KEY AUTOINCREMENT, origin TEXT, ops TEXT)')
+
+    # --- Startup ---
+
+    def recover(self):
+        """Loads the table layout and the feed position; SQLite itself rolls back interrupted transactions."""
+        with self._conn_lock:
+            self._load_columns()
+            self.seq = self._head()
+
+    def _load_columns(self):
+        self._columns = {}
+        for (table,) in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'"):
+            if table.startswith(('_', 'sqlite_')): continue
+            self._columns[table] = {row[1] for row in self.conn.execute(f'PRAGMA table_info({_quote(table)})')}
+
+    def has_tables(self):
+        return bool(self._columns)
+
+    def read(self, table):
+        """The whole table as a frame in insertion order, or None if it does not exist."""
+        with self._conn_lock:
+            if table not in self._columns: return None
+            frame = pd.read_sql_query(f'SELECT * FROM {_quote(table)} ORDER BY rowid', self.conn)
+        # All-NULL columns come back as None objects; read_csv would give NaN floats
+        for col in frame.columns[frame.isna().all()]:
+            frame[col] = np.nan
+        return frame
+
+    def replay(self, table, frame):
+        return frame
+
+    # --- Writes ---
+
+    def _ensure_table(self, table, columns):
+        known = self._columns.get(table)
+        if known is None:
+            self.conn.execute(f'CREATE TABLE {_quote(table)} ({", ".join(_quote(c) for c in columns)})')
+            known = self._columns[table] = set(columns)
+            for col in [self.keys.get(table)] + self.indexes.get(table, []):
+                if col is None or col not in known: continue
+                self.conn.execute(f'CREATE INDEX IF NOT EXISTS {_quote(f"idx_{table}_{col}")} '
+                                  f'ON {_quote(table)} ({_quote(col)})')
+            return
+        for col in columns:
+            if col in known: continue
+            self.conn.execute(f'ALTER TABLE {_quote(table)} ADD COLUMN {_quote(col)}')
+            known.add(col)
+
+    def _insert(self, table, rows):
+        if not rows: return
+        columns = list(dict.fromkeys(col for row in rows for col in row))
+        self._ensure_table(table, columns)
+        self.conn.executemany(
+            f'INSERT INTO {_quote(table)} ({", ".join(_quote(c) for c in columns)}) '
+            f'VALUES ({", ".join("?" for _ in columns)})',
+            [[_sql_value(row.get(col)) for col in columns] for row in rows]
+        )
+
+    def _apply(self, table, op, rows=None, key=None, values=None):
+        if op == 'insert':
+            self._insert(table, rows)
+            return
+        key_col = _quote(self.keys[table])
+        if op == 'update':
+            self._ensure_table(table, list(values))
+            assignments = ', '.join(f'{_quote(c)} = ?' for c in values)
+            # Like the in-memory primary-key index, the first row with the key wins
+            self.conn.execute(
+                f'UPDATE {_quote(table)} SET {assignments} WHERE rowid = '
+                f'(SELECT MIN(rowid) FROM {_quote(table)} WHERE {key_col} = ?)',
+                [_sql_value(v) for v in values.values()] + [_sql_value(key)]
+            )
+        elif op == 'delete':
+            if table in self._columns:
+                self.conn.execute(f'DELETE FROM {_quote(table)} WHERE {key_col} = ?', [_sql_value(key)])
+
+    def _transaction(self, ops):
+        with self.lock, self._conn_lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                for op in ops:
+                    self._apply(**op)
+                seq = self.conn.execute(
+                    f'INSERT INTO {self.CHANGES_TABLE} (origin, ops) VALUES (?, ?)',
+                    (self.origin, json.dumps(ops, default=_json_default))
+                ).lastrowid
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                self._load_columns()  # forget columns and tables the rolled-back DDL created
+                raise
+            self.seq = seq
+            return seq
+
+    def append(self, table, op, **fields):
+        """Applies one mutation as its own transaction."""
+        return self._transaction([dict(fields, table=table, op=op)])
+
+    def commit(self, ops):
+        """Applies operations spanning several tables in one transaction (see TableStore.commit)."""
+        return self._transaction(ops)
+
+    def write_table(self, table, frame):
+        """Replaces a table with the rows of a frame; used by the CSV migration."""
+        with self.lock, self._conn_lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                self.conn.execute(f'DROP TABLE IF EXISTS {_quote(table)}')
+                self._columns.pop(table, None)
+                self._ensure_table(table, [str(c) for c in frame.columns])
+                self._insert(table, frame.to_dict(orient='records'))
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                self._load_columns()
+                raise
+
+    # --- Change feed ---
+
+    def _head(self):
+        return self.conn.execute(f'SELECT COALESCE(MAX(seq), 0) FROM {self.CHANGES_TABLE}').fetchone()[0]
+
+    def has_changes(self):
+        """Whether any process committed past this process's feed position."""
+        with self._conn_lock:
+            return self._head() > self.seq
+
+    def changes(self):
+        """Operations other processes committed since the last call, oldest first.
+
+        Returns None if the feed has been pruned past this process's position;
+        the caller must then reload every table. Call with lock held, so no
+        commit can slip in between.
+        """
+        with self._conn_lock:
+            first = self.conn.execute(f'SELECT MIN(seq) FROM {self.CHANGES_TABLE}').fetchone()[0]
+            entries = self.conn.execute(
+                f'SELECT seq, origin, ops FROM {self.CHANGES_TABLE} WHERE seq > ? ORDER BY seq', (self.seq,)
+            ).fetchall()
+            if entries and first > self.seq + 1:
+                self.seq = entries[-1][0]
+                return None
+            ops = [op for _, origin, ops in entries if origin != self.origin for op in json.loads(ops)]
+            if entries: self.seq = entries[-1][0]
+            return ops
+
+    # --- Compaction ---
+
+    def pending(self):
+        return {}
+
+    def compact(self, frame_source=None):
+        """Checkpoints the SQLite WAL into the database file and trims the change feed."""
+        with self._conn_lock:
+            self.conn.execute(f'DELETE FROM {self.CHANGES_TABLE} WHERE seq <= ?',
+                              (self._head() - self.keep_changes,))
+            self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        return []
+
+    def start_compactor(self, frame_source=None, interval_seconds=60):
+        """Checkpoints in a background thread every interval_seconds."""
+        if self._compactor is not None: return
+
+        def run():
+            while not self._stop.wait(interval_seconds):
+                try:
+                    self.compact()
+                except Exception as e:
+                    print(f"SQLite checkpoint failed: {e}")
+
+        self._compactor = threading.Thread(target=run, name='sqlite-checkpointer', daemon=True)
+        self._compactor.start()
+
+    def close(self, frame_source=None):
+        """Stops the checkpointer, checkpoints once more and closes the connections."""
+        self._stop.set()
+        with self._conn_lock:
+            self.compact()
+            self.conn.close()
+        self.lock.close()
+
+
+def migrate_csv(data_dir, db, tables=None):
+    """One-shot copy of the CSV tables (with their write-ahead logs replayed) into a SQLiteStore.
+
+    tables defaults to every table in db.keys; tables without a CSV are
+    skipped. Returns {table: rows copied}.
+    """
+    csv_store = TableStore(data_dir, db.keys)
+    csv_store.recover()
+    copied = {}
+    try:
+        with db.lock:
+            for table in tables or list(db.keys):
+                frame = csv_store.read(table)
+                if frame is None: continue
+                if table in db.keys: frame = csv_store.replay(table, frame)
+                db.write_table(table, frame)
+                copied[table] = len(frame)
+    finally:
+        # Releases the CSV store's directory lock
+        csv_store.close()
+    return copied
+
+
+if __name__ == "__main__":
+    # python -m app.sqlite_store <data_dir> [db_path]
+    from .logic_engine import RecommendationEngine
+
+    data_dir = sys.argv[1] if len(sys.argv) > 1 else 'data'
+    db_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(data_dir, RecommendationEngine.SQLITE_FILE)
+    db = SQLiteStore(db_path, RecommendationEngine.TABLE_KEYS, RecommendationEngine.GROUP_KEYS)
+    db.recover()
+    try:
+        copied = migrate_csv(data_dir, db, RecommendationEngine.STORED_TABLES)
+    finally:
+        db.close()
+    for table, count in copied.items():
+        print(f"{table}: {count} rows")
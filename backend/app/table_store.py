@@ -0,0 +1,290 @@
+import json
+import os
+import threading
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class StoreLockedError(RuntimeError):
+    """Another process already has the CSV store of this data directory open."""
+
+
+def _json_default(value):
+    if isinstance(value, np.generic): return value.item()
+    if isinstance(value, (datetime, date, pd.Timestamp)): return value.isoformat()
+    return str(value)
+
+
+class TableStore:
+    """Append-only per-table write-ahead logs on top of the CSV snapshots.
+
+    Every mutation appends one JSON line ({"seq", "op", ...}) to
+    wal/<table>.log instead of rewriting <table>.csv. A compaction pass writes
+    fresh CSV snapshots and drops the log records they cover; on startup the
+    snapshot is loaded and the records newer than its watermark are replayed.
+
+    Writes that must land together (e.g. a checkout touching products, orders
+    and interactions) go through commit(), which writes all of their operations
+    as a single line of wal/txn.log; a torn line is discarded as a whole, so the
+    commit is all-or-nothing. Replay merges txn.log with the per-table logs by
+    sequence number.
+
+    The CSVs and logs belong to one process: recover() takes an exclusive lock
+    on wal/LOCK and fails fast if another process holds it, since two writers
+    would each compact over the other's changes. Use SQLite storage to share a
+    data directory between several workers.
+
+    Compaction is crash-safe: snapshots are first written as
+    <table>.csv.<generation>.tmp, then manifest.json records the new generation
+    and per-table watermarks (the commit point), then the temp files are renamed
+    into place. Temp files of the committed generation are rolled forward on
+    the next start, any others are discarded.
+    """
+
+    TXN_LOG = 'txn'
+
+    def __init__(self, data_dir, keys, fsync=True):
+        self.data_dir = data_dir
+        self.keys = dict(keys)  # table -> primary key column (None for append-only tables)
+        self.fsync = fsync
+        self.wal_dir = os.path.join(data_dir, 'wal')
+        self.manifest_path = os.path.join(self.wal_dir, 'manifest.json')
+        self.lock_path = os.path.join(self.wal_dir, 'LOCK')
+        self.lock = threading.RLock()
+        self.generation = 0
+        self.watermarks = {}
+        self.seq = 0
+        self._pending = {}
+        self._handles = {}
+        self._stop = threading.Event()
+        self._compactor = None
+        self._lock_file = None
+
+    # --- Startup ---
+
+    def recover(self):
+        """Locks the data directory, then finishes or discards an interrupted compaction; call before reading the CSVs."""
+        os.makedirs(self.wal_dir, exist_ok=True)
+        self._lock_dir()
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r') as f:
+                manifest = json.load(f)
+            self.generation = manifest.get('generation', 0)
+            self.watermarks = manifest.get('watermarks', {})
+        self.seq = max(self.watermarks.values(), default=0)
+
+        for name in os.listdir(self.data_dir):
+            if not name.endswith('.tmp') or '.csv.' not in name: continue
+            base, gen = name[:-len('.tmp')].rsplit('.', 1)
+            tmp_path = os.path.join(self.data_dir, name)
+            if gen == str(self.generation):
+                os.replace(tmp_path, os.path.join(self.data_dir, base))
+            else:
+                os.remove(tmp_path)
+
+    def _lock_dir(self):
+        if self._lock_file is not None: return
+        handle = open(self.lock_path, 'a+')
+        try:
+            if fcntl: fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else: msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            handle.close()
+            raise StoreLockedError(
+                f"{self.data_dir} is already open in another process; "
+                "set ENGINE_STORAGE=sqlite to run several workers") from None
+        self._lock_file = handle
+
+    def read(self, table):
+        """The table's CSV snapshot as a frame, or None if there is none."""
+        path = os.path.join(self.data_dir, f'{table}.csv')
+        if not os.path.exists(path) or os.path.getsize(path) == 0: return None
+        return pd.read_csv(path)
+
+    def _read_lines(self, path):
+        if not os.path.exists(path): return []
+        records = []
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue  # torn tail from a crash mid-append; never acknowledged
+        if records: self.seq = max(self.seq, records[-1]['seq'])
+        return records
+
+    def read_log(self, table):
+        """Log records of a table that are newer than its snapshot watermark, in commit order."""
+        watermark = self.watermarks.get(table, 0)
+        records = [r for r in self._read_lines(self._log_path(table)) if r['seq'] > watermark]
+        for txn in self._read_lines(self._log_path(self.TXN_LOG)):
+            if txn['seq'] <= watermark: continue
+            records.extend(dict(op, seq=txn['seq']) for op in txn['ops'] if op['table'] == table)
+        records.sort(key=lambda r: r['seq'])
+        self._pending[table] = len(records)
+        return records
+
+    def replay(self, table, frame):
+        """Applies the table's unsnapshotted log records to a freshly loaded frame."""
+        records = self.read_log(table)
+        if not records: return frame
+        key_col = self.keys.get(table)
+        positions = {} if key_col is None or frame.empty else {k: i for i, k in enumerate(frame[key_col])}
+        frame = frame.reset_index(drop=True)
+        inserts = []
+
+        def flush(frame):
+            if not inserts: return frame
+            frame = pd.concat([frame, pd.DataFrame(inserts)], ignore_index=True) if not frame.empty else pd.DataFrame(inserts)
+            inserts.clear()
+            return frame
+
+        for record in records:
+            op = record['op']
+            if op == 'insert':
+                for row in record['rows']:
+                    if key_col is not None: positions[row.get(key_col)] = len(frame) + len(inserts)
+                    inserts.append(row)
+            elif op == 'update':
+                frame = flush(frame)
+                pos = positions.get(record['key'])
+                if pos is None: continue
+                for col, val in record['values'].items():
+                    if col not in frame.columns: frame[col] = None
+                    frame.at[pos, col] = val
+            elif op == 'delete':
+                frame = flush(frame)
+                frame = frame[frame[key_col] != record['key']].reset_index(drop=True)
+                positions = {k: i for i, k in enumerate(frame[key_col])}
+        return flush(frame)
+
+    # --- Writes ---
+
+    def _log_path(self, table):
+        return os.path.join(self.wal_dir, f'{table}.log')
+
+    def _write_line(self, log_name, record):
+        line = json.dumps(record, default=_json_default)
+        handle = self._handles.get(log_name)
+        if handle is None:
+            handle = self._handles[log_name] = open(self._log_path(log_name), 'a')
+        handle.write(line + '\n')
+        handle.flush()
+        if self.fsync: os.fsync(handle.fileno())
+
+    def append(self, table, op, **fields):
+        """Appends one record to the table's log. Callers hold self.lock across mutate + append."""
+        with self.lock:
+            self.seq += 1
+            self._write_line(table, {'seq': self.seq, 'op': op, **fields})
+            self._pending[table] = self._pending.get(table, 0) + 1
+            return self.seq
+
+    def commit(self, ops):
+        """Atomically logs operations spanning several tables as one record.
+
+        Each op is a dict with 'table', 'op' and the op's fields ('rows',
+        'key'/'values' or 'key'), exactly as append() would log them.
+        """
+        with self.lock:
+            self.seq += 1
+            self._write_line(self.TXN_LOG, {'seq': self.seq, 'op': 'txn', 'ops': ops})
+            for table in {op['table'] for op in ops}:
+                self._pending[table] = self._pending.get(table, 0) + 1
+            return self.seq
+
+    def has_changes(self):
+        """Always False: the CSV store is used by a single process, so nothing changes behind its back."""
+        return False
+
+    def changes(self):
+        return []
+
+    # --- Compaction ---
+
+    def pending(self):
+        with self.lock:
+            return {t: n for t, n in self._pending.items() if n}
+
+    def compact(self, frame_source):
+        """Writes fresh snapshots of every table with logged changes and truncates their logs.
+
+        frame_source(table) must return the current in-memory frame; it is
+        called under the store lock so the copy and the watermark agree.
+        """
+        with self.lock:
+            tables = [t for t, n in self._pending.items() if n]
+            if not tables: return []
+            frames = {t: frame_source(t).copy() for t in tables}
+            watermark = self.seq
+            generation = self.generation + 1
+
+        tmp_paths = {}
+        for table, frame in frames.items():
+            tmp_paths[table] = os.path.join(self.data_dir, f'{table}.csv.{generation}.tmp')
+            frame.to_csv(tmp_paths[table], index=False)
+
+        with self.lock:
+            watermarks = dict(self.watermarks, **{t: watermark for t in tables})
+            manifest_tmp = self.manifest_path + '.tmp'
+            with open(manifest_tmp, 'w') as f:
+                json.dump({'generation': generation, 'watermarks': watermarks}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(manifest_tmp, self.manifest_path)
+            self.generation, self.watermarks = generation, watermarks
+
+            for table, tmp_path in tmp_paths.items():
+                os.replace(tmp_path, os.path.join(self.data_dir, f'{table}.csv'))
+                self._rewrite_log(table, lambda r: r['seq'] > watermark)
+            # A commit record is needed until every table it touches is snapshotted past it
+            self._rewrite_log(self.TXN_LOG, lambda r: any(
+                r['seq'] > self.watermarks.get(op['table'], 0) for op in r['ops']
+            ))
+            for table in tables:
+                self._pending[table] = len(self.read_log(table))
+        return tables
+
+    def _rewrite_log(self, log_name, keep_record):
+        handle = self._handles.pop(log_name, None)
+        if handle: handle.close()
+        path = self._log_path(log_name)
+        if not os.path.exists(path): return
+        keep = [r for r in self._read_lines(path) if keep_record(r)]
+        with open(path + '.tmp', 'w') as f:
+            f.writelines(json.dumps(r, default=_json_default) + '\n' for r in keep)
+        os.replace(path + '.tmp', path)
+
+    def start_compactor(self, frame_source, interval_seconds=60):
+        """Compacts dirty tables in a background thread every interval_seconds."""
+        if self._compactor is not None: return
+
+        def run():
+            while not self._stop.wait(interval_seconds):
+                try:
+                    self.compact(frame_source)
+                except Exception as e:
+                    print(f"Table compaction failed: {e}")
+
+        self._compactor = threading.Thread(target=run, name='table-compactor', daemon=True)
+        self._compactor.start()
+
+    def close(self, frame_source=None):
+        """Stops the compactor, optionally runs a final compaction and closes the logs."""
+        self._stop.set()
+        if frame_source is not None: self.compact(frame_source)
+        with self.lock:
+            for handle in self._handles.values(): handle.close()
+            self._handles.clear()
+            # Closing the file drops the lock
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
@@ -0,0 +1,66 @@
+import heapq
+import numpy as np
+import pandas as pd
+
+from .snapshot import layered_copy
+
+
+class TrustScores:
+    """Per-user trust scores (100 minus the return rate in percent), kept current as orders and returns arrive.
+
+    Order and return counts for every user come from one group-by each at
+    build time; afterwards each new order or return only recomputes the score
+    of the user it belongs to. Users without orders score 100.
+    """
+
+    def __init__(self):
+        self._orders = {}
+        self._returns = {}
+        self._scores = {}
+
+    def build(self, orders, return_requests):
+        order_counts = orders.groupby('user_id').size() if not orders.empty else pd.Series(dtype='int64')
+        return_counts = return_requests.groupby('user_id').size() if not return_requests.empty else pd.Series(dtype='int64')
+        counts = pd.DataFrame({'orders': order_counts, 'returns': return_counts}).fillna(0).astype('int64')
+
+        n_orders = counts['orders'].to_numpy()
+        n_returns = counts['returns'].to_numpy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rate = n_returns / n_orders
+        scores = np.where(n_orders > 0, np.clip(100 - np.trunc(rate * 100), 0, None), 100).astype(int)
+
+        self._orders = dict(zip(counts.index, n_orders.tolist()))
+        self._returns = dict(zip(counts.index, n_returns.tolist()))
+        self._scores = dict(zip(counts.index, scores.tolist()))
+
+    def copy(self):
+        """A copy for a writer; it shares the per-user dicts with this one (see layered_copy)."""
+        clone = TrustScores()
+        clone._orders, clone._returns, clone._scores = map(layered_copy, (self._orders, self._returns, self._scores))
+        return clone
+
+    def _rescore(self, user_id):
+        total_orders = self._orders.get(user_id, 0)
+        if total_orders == 0:
+            self._scores[user_id] = 100
+            return
+        return_rate = self._returns.get(user_id, 0) / total_orders
+        self._scores[user_id] = max(0, 100 - int(return_rate * 100))
+
+    def add_order(self, user_id):
+        self._orders[user_id] = self._orders.get(user_id, 0) + 1
+        self._rescore(user_id)
+
+    def add_return(self, user_id):
+        self._returns[user_id] = self._returns.get(user_id, 0) + 1
+        self._rescore(user_id)
+
+    def score(self, user_id):
+        return self._scores.get(user_id, 100)
+
+    def scores(self, user_ids):
+        return {uid: self._scores.get(uid, 100) for uid in user_ids}
+
+    def lowest(self, n):
+        """The n least trusted users as (user_id, score) pairs, lowest first."""
+        return heapq.nsmallest(n, list(self._scores.items()), key=lambda item: item[1])
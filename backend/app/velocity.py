@@ -0,0 +1,75 @@
+from datetime import date, timedelta
+
+import pandas as pd
+
+
+class SalesVelocity:
+    """Units sold per retailer and product, bucketed by day and maintained as orders arrive.
+
+    Lifetime totals are kept alongside the day buckets so the common "units
+    sold" read is a dict lookup; trailing-window sums only visit the buckets
+    of the products the retailer has sold. Items whose order date cannot be
+    parsed count towards the totals only.
+
+    Copies share the per-retailer dicts; a copy duplicates a retailer's dicts,
+    and a product's day buckets, the first time it adds to them.
+    """
+
+    def __init__(self):
+        self._totals = {}  # retailer -> {product: units}
+        self._days = {}  # retailer -> {product: {day: units}}
+        self._owned = None  # retailers and (retailer, product) pairs this copy duplicated; None: owns all
+
+    def build(self, order_items, orders):
+        """Rebuilds every aggregate from per-item order rows (order_id, retailer_id, product_id, qty) and the order dates."""
+        self._totals, self._days, self._owned = {}, {}, None
+        if order_items.empty: return
+        order_dates = pd.to_datetime(orders.set_index('order_id')['timestamp'], errors='coerce', format='ISO8601')
+        order_dates = order_dates[~order_dates.index.duplicated()]
+        days = order_items['order_id'].map(order_dates).dt.date
+
+        grouped = order_items.assign(day=days).groupby(['retailer_id', 'product_id', 'day'], dropna=False)['qty'].sum()
+        for (retailer_id, product_id, day), qty in grouped.items():
+            self._add(retailer_id, product_id, int(qty), None if pd.isna(day) else day)
+
+    def copy(self):
+        clone = SalesVelocity()
+        clone._totals, clone._days, clone._owned = dict(self._totals), dict(self._days), set()
+        return clone
+
+    def _own(self, retailer_id, product_id):
+        if retailer_id not in self._owned:
+            self._totals[retailer_id] = dict(self._totals.get(retailer_id, {}))
+            self._days[retailer_id] = dict(self._days.get(retailer_id, {}))
+            self._owned.add(retailer_id)
+        days = self._days[retailer_id]
+        days[product_id] = dict(days.get(product_id, {}))
+        self._owned.add((retailer_id, product_id))
+
+    def _add(self, retailer_id, product_id, qty, day):
+        if self._owned is not None and (retailer_id, product_id) not in self._owned:
+            self._own(retailer_id, product_id)
+        totals = self._totals.setdefault(retailer_id, {})
+        totals[product_id] = totals.get(product_id, 0) + qty
+        if day is not None:
+            buckets = self._days.setdefault(retailer_id, {}).setdefault(product_id, {})
+            buckets[day] = buckets.get(day, 0) + qty
+
+    def record(self, retailer_id, product_id, qty, ts=None):
+        """Counts qty units of a product sold by a retailer at ts (default: now)."""
+        day = pd.Timestamp(ts).date() if ts is not None else date.today()
+        self._add(retailer_id, str(product_id), int(qty), day)
+
+    def totals(self, retailer_id):
+        """{product_id: units sold} over the retailer's whole history."""
+        return dict(self._totals.get(retailer_id, {}))
+
+    def window(self, retailer_id, days, today=None):
+        """{product_id: units sold} over the trailing `days` days, including today."""
+        today = today or date.today()
+        start = today - timedelta(days=days - 1)
+        sums = {}
+        for product_id, buckets in self._days.get(retailer_id, {}).items():
+            qty = sum(q for day, q in buckets.items() if start <= day <= today)
+            if qty: sums[product_id] = qty
+        return sums
@@ -0,0 +1,170 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class WriteBehindQueue:
+    """Bounded queue of Firestore writes drained by background worker threads.
+
+    Writes are (op, collection, doc_id, data) tuples as accepted by
+    FirestoreService.commit_batch. Writes to a document that is still queued
+    are coalesced into the queued one (update-after-set merges into the set,
+    a later set or delete replaces it), so a burst of updates costs a single
+    round trip. A document is never in two in-flight batches at once, so
+    writes to it land in order.
+
+    Failed batches are retried with exponential backoff; after max_retries the
+    batch is retried one write at a time so a single bad write cannot sink
+    the others, and writes that still fail are dropped and counted.
+
+    A full queue blocks put() for at most put_timeout seconds; the write is
+    then dropped and counted, so a Firestore outage that stops the queue from
+    draining cannot hang callers (some of which hold the engine's writer lock).
+    """
+
+    def __init__(self, commit_fn, workers=2, maxsize=10000, batch_size=500, max_retries=5, backoff_seconds=0.5,
+                 put_timeout=5.0):
+        self.commit_fn = commit_fn
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.put_timeout = put_timeout
+        self._pending = OrderedDict()  # key -> [op, collection, doc_id, data, enqueued_at]
+        self._inflight = {}  # key -> entry being committed
+        self._cond = threading.Condition()
+        self._closed = False
+        self._seq = 0
+        self.enqueued = 0
+        self.coalesced = 0
+        self.committed = 0
+        self.retries = 0
+        self.failed = 0
+        self.dropped = 0
+        self.last_lag_seconds = 0.0
+        self._workers = [
+            threading.Thread(target=self._run, name=f'firestore-writer-{i}', daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers: worker.start()
+
+    def put(self, op, collection, doc_id, data=None, timeout=None):
+        """Queues one write, blocking while the queue is full (up to timeout, default put_timeout).
+
+        Returns False if the queue is closed or stayed full; such a write is dropped.
+        """
+        with self._cond:
+            if self._closed: return False
+            key = (collection, doc_id) if op != 'add' else None
+            entry = self._pending.get(key) if key is not None else None
+            if entry is not None:
+                self._coalesce(entry, op, data)
+                self.coalesced += 1
+                return True
+            timeout = self.put_timeout if timeout is None else timeout
+            if not self._cond.wait_for(lambda: len(self._pending) < self.maxsize or self._closed, timeout):
+                self.dropped += 1
+                print(f"Firestore write-behind queue full; dropped {op} {collection}/{doc_id}")
+                return False
+            if self._closed: return False
+            if key is None:
+                self._seq += 1
+                key = ('add', self._seq)
+            self._pending[key] = [op, collection, doc_id, data, time.monotonic()]
+            self.enqueued += 1
+            self._cond.notify_all()
+            return True
+
+    @staticmethod
+    def _coalesce(entry, op, data):
+        if op == 'update' and entry[0] in ('set', 'update'):
+            entry[3] = {**entry[3], **data}
+        else:
+            entry[0], entry[3] = op, data
+
+    def pending_write(self, collection, doc_id):
+        """The net unflushed (op, data) for a document, or None; lets reads see queued writes."""
+        key = (collection, doc_id)
+        with self._cond:
+            net = None
+            for entry in (self._inflight.get(key), self._pending.get(key)):
+                if entry is None: continue
+                if net is None:
+                    net = list(entry)
+                else:
+                    self._coalesce(net, entry[0], entry[3])
+            return (net[0], dict(net[3] or {})) if net else None
+
+    def _take_batch(self):
+        batch = []
+        for key, entry in self._pending.items():
+            if key in self._inflight: continue
+            batch.append((key, entry))
+            if len(batch) >= self.batch_size: break
+        for key, entry in batch:
+            del self._pending[key]
+            self._inflight[key] = entry
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._closed or any(k not in self._inflight for k in self._pending))
+                batch = self._take_batch()
+                if not batch and self._closed: return
+            if batch: self._commit(batch)
+
+    def _commit(self, batch):
+        writes = [tuple(entry[:4]) for _, entry in batch]
+        ok = self._commit_with_retry(writes)
+        failed = 0
+        if not ok:
+            failed = len(writes) if len(writes) == 1 else sum(not self._commit_with_retry([w], 1) for w in writes)
+        with self._cond:
+            for key, _ in batch:
+                self._inflight.pop(key, None)
+            self.committed += len(writes) - failed
+            self.failed += failed
+            self.last_lag_seconds = time.monotonic() - min(entry[4] for _, entry in batch)
+            self._cond.notify_all()
+
+    def _commit_with_retry(self, writes, attempts=None):
+        attempts = attempts or self.max_retries
+        for attempt in range(attempts):
+            if self.commit_fn(writes): return True
+            if attempt + 1 < attempts:
+                with self._cond:
+                    self.retries += 1
+                time.sleep(self.backoff_seconds * (2 ** attempt))
+        return False
+
+    def flush(self, timeout=None):
+        """Blocks until every queued write has been committed or dropped."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._inflight, timeout)
+
+    def close(self, timeout=30):
+        """Flushes the queue, then stops the workers."""
+        flushed = self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for worker in self._workers: worker.join(timeout)
+        return flushed
+
+    def stats(self):
+        with self._cond:
+            oldest = min((entry[4] for entry in self._pending.values()), default=None)
+            return {
+                "depth": len(self._pending),
+                "inflight": len(self._inflight),
+                "maxsize": self.maxsize,
+                "enqueued": self.enqueued,
+                "coalesced": self.coalesced,
+                "committed": self.committed,
+                "retries": self.retries,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "oldest_pending_seconds": round(time.monotonic() - oldest, 3) if oldest is not None else 0.0,
+                "last_commit_lag_seconds": round(self.last_lag_seconds, 3)
+            }
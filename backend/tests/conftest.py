@@ -0,0 +1,23 @@
+"""
+Shared fixtures for the backend tests. Run from backend/: python -m pytest -q
+"""
+
+import os
+import shutil
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    """A private copy of the sample data, so tests never write to backend/data"""
+    path = tmp_path / "data"
+    shutil.copytree(
+        os.path.join(BACKEND_DIR, "data"), path,
+        ignore=shutil.ignore_patterns("engine.db*", "wal", "activity_log.jsonl", "firestore_sync_state.json")
+    )
+    return str(path)
@@ -0,0 +1,199 @@
+"""
+Firestore batching and write-behind against the in-process fake client, and
+engine storage: write-ahead log replay after a crash and the change feed
+between two engines sharing one SQLite database.
+"""
+
+import subprocess
+import sys
+import textwrap
+import threading
+
+from app.firestore_service import FirestoreService
+from app.logic_engine import RecommendationEngine
+from app.memory_firestore import InMemoryFirestore, MemoryWriteBatch
+
+from conftest import BACKEND_DIR
+
+
+class CountingFirestore(InMemoryFirestore):
+    """InMemoryFirestore that records the size of every committed batch"""
+
+    def __init__(self, latency_seconds=0.0):
+        super().__init__(latency_seconds)
+        self.batch_sizes = []
+
+    def batch(self):
+        client = self
+
+        class CountingBatch(MemoryWriteBatch):
+            def commit(self):
+                client.batch_sizes.append(len(self._writes))
+                return super().commit()
+
+        return CountingBatch(self)
+
+
+def _docs(client, collection):
+    return {doc.id: doc.to_dict() for doc in client.collection(collection).stream()}
+
+
+def _engine(data_dir, **kwargs):
+    engine = RecommendationEngine(data_dir=data_dir, use_firestore=False, compact_interval=0, **kwargs)
+    engine.load_data()
+    return engine
+
+
+# --- Firestore batching ---
+
+def test_commit_batch_splits_at_500_writes():
+    client = CountingFirestore()
+    fs = FirestoreService(client=client)
+    try:
+        writes = [("set", "products", f"P{i}", {"n": i}) for i in range(1201)]
+        assert fs.commit_batch(writes)
+        assert client.batch_sizes == [500, 500, 201]
+        assert len(_docs(client, "products")) == 1201
+    finally:
+        fs.close()
+
+
+def test_write_behind_coalesces_writes_to_one_document():
+    client = CountingFirestore(latency_seconds=0.02)
+    fs = FirestoreService(client=client, write_behind=True)
+    try:
+        assert fs.commit_batch([("set", "products", "P1", {"stock": 0, "name": "x"})])
+        for stock in range(1, 101):
+            fs.commit_batch([("update", "products", "P1", {"stock": stock})])
+        assert fs.flush(timeout=10)
+        assert _docs(client, "products") == {"P1": {"stock": 100, "name": "x"}}
+        assert sum(client.batch_sizes) < 101
+        assert fs.queue_stats()["coalesced"] > 0
+    finally:
+        fs.close()
+
+
+def test_write_behind_keeps_the_order_of_writes_to_a_document():
+    client = CountingFirestore(latency_seconds=0.01)
+    fs = FirestoreService(client=client, write_behind=True)
+    try:
+        fs.commit_batch([("set", "users", "U1", {"v": 1})])
+        fs.commit_batch([("delete", "users", "U1", None)])
+        fs.commit_batch([("set", "users", "U1", {"v": 2})])
+        fs.commit_batch([("update", "users", "U1", {"w": 3})])
+        fs.commit_batch([("set", "users", "U2", {"v": 1})])
+        fs.commit_batch([("delete", "users", "U2", None)])
+        assert fs.flush(timeout=10)
+        assert _docs(client, "users") == {"U1": {"v": 2, "w": 3}}
+    finally:
+        fs.close()
+
+
+def test_write_behind_flushes_on_close():
+    client = CountingFirestore(latency_seconds=0.02)
+    fs = FirestoreService(client=client, write_behind=True)
+    for i in range(50):
+        fs.commit_batch([("set", "orders", f"O{i}", {"n": i})])
+    assert fs.close(timeout=10)
+    assert len(_docs(client, "orders")) == 50
+
+
+# --- Write-ahead log ---
+
+def test_csv_writes_survive_a_crash_without_close(data_dir):
+    """A process that exits without close() loses nothing it acknowledged"""
+    script = textwrap.dedent(f"""
+        import os, sys
+        sys.path.insert(0, {BACKEND_DIR!r})
+        from app.logic_engine import RecommendationEngine
+        engine = RecommendationEngine(data_dir={data_dir!r}, use_firestore=False, compact_interval=0)
+        engine.load_data()
+        engine.update_product_stock_price('P0001', new_stock=4321)
+        print(engine.place_order('U001', 'R001', {{'P0002': 1}}), flush=True)
+        os._exit(0)
+    """)
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, timeout=120)
+    order_id = result.stdout.strip().splitlines()[-1]
+
+    engine = _engine(data_dir)
+    try:
+        assert engine.get_product("P0001")["stock_count"] == 4321
+        assert order_id in set(engine.orders["order_id"])
+    finally:
+        engine.close()
+
+
+# --- Change feed between workers ---
+
+def test_change_feed_applies_other_engines_commits(data_dir):
+    a = _engine(data_dir, storage="sqlite", change_feed_interval=0)
+    b = _engine(data_dir, storage="sqlite", change_feed_interval=0)
+    try:
+        a.update_product_stock_price("P0001", new_stock=500)
+        a.place_order("U001", "R001", {"P0001": 2})
+        a.delete_product("P0005")
+        b.catch_up()
+
+        assert b.get_product("P0001")["stock_count"] == 498
+        assert b.get_product("P0005") is None
+        assert len(b.orders) == len(a.orders)
+        assert b.velocity.totals("R001") == a.velocity.totals("R001")
+        assert b.trust.score("U001") == a.trust.score("U001")
+    finally:
+        a.close()
+        b.close()
+
+
+class _HookedLock:
+    """Runs a callback once, right after the first outermost release of a lock"""
+
+    def __init__(self, lock, callback):
+        self._lock = lock
+        self._callback = callback
+        self._depth = 0
+
+    def acquire(self):
+        self._lock.acquire()
+        self._depth += 1
+        return True
+
+    def release(self):
+        self._depth -= 1
+        self._lock.release()
+        if self._depth == 0 and self._callback:
+            callback, self._callback = self._callback, None
+            callback()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def __getattr__(self, name):
+        return getattr(self._lock, name)
+
+
+def test_change_feed_delete_while_another_engine_starts(data_dir):
+    """A commit landing just after a worker's first locked section at startup is applied on top of its tables"""
+    a = _engine(data_dir, storage="sqlite", change_feed_interval=0)
+    b = RecommendationEngine(data_dir=data_dir, use_firestore=False, compact_interval=0,
+                             storage="sqlite", change_feed_interval=0)
+    deleted = threading.Event()
+
+    def delete_from_a():
+        a.delete_product("P0005")
+        deleted.set()
+
+    b.store.lock = _HookedLock(b.store.lock, delete_from_a)
+    try:
+        b.load_data()
+        assert deleted.is_set()
+        b.catch_up()
+
+        assert len(b.products) == len(a.products) > 0
+        assert len(b.users) > 0 and len(b.orders) > 0
+        assert b.get_product("P0005") is None
+    finally:
+        a.close()
+        b.close()